@@ -8,6 +8,11 @@ import mne
 from scipy import ndimage, signal
 import pandas as pd
 from utils import *
+from chunked_store import ChunkedVolume
+from volume_summary import summarize_volume
+from memory_governor import GOVERNOR
+
+PREVIEW_VOXELS = 128 ** 3
 
 def render_advanced_features():
     """Render advanced features page"""
@@ -49,8 +54,13 @@ def render_data_preprocessing():
         st.warning("⚠️ Please load NIfTI data first")
         return
     
-    data = st.session_state.nifti_data['data'].copy()
-    original_data = st.session_state.nifti_data['data'].copy()
+    volume = st.session_state.nifti_data['data']
+    if isinstance(volume, ChunkedVolume):
+        # обработка идет по блокам в новые хранилища, исходный объем не меняется
+        data = original_data = volume
+    else:
+        # массив общий для всех сессий и только для чтения: каждая операция ниже создает новый
+        data = original_data = volume.load()
     
     col1, col2 = st.columns([1, 2])
     
@@ -97,22 +107,14 @@ def render_data_preprocessing():
             
             # Применяем морфологические операции
             if morphology:
-                if morph_op == "erosion":
-                    data = ndimage.binary_erosion(data, structure=np.ones((morph_size,)*3))
-                elif morph_op == "dilation":
-                    data = ndimage.binary_dilation(data, structure=np.ones((morph_size,)*3))
-                elif morph_op == "opening":
-                    data = ndimage.binary_opening(data, structure=np.ones((morph_size,)*3))
-                elif morph_op == "closing":
-                    data = ndimage.binary_closing(data, structure=np.ones((morph_size,)*3))
+                data = apply_morphology(data, morph_op, morph_size)
             
-            # Сохраняем обработанные данные
-            st.session_state.processed_data = data
+            # Сохраняем обработанные данные (при нехватке памяти они уходят на диск)
+            GOVERNOR.put(st.session_state.session_id, 'processed_data', data)
             st.success("✅ Preprocessing applied successfully!")
     
     with col2:
-        if 'processed_data' in st.session_state:
-            data = st.session_state.processed_data
+        data = GOVERNOR.get(st.session_state.session_id, 'processed_data', data)
         
         # Сравнение до и после
         st.subheader("Preprocessing Results")
@@ -154,7 +156,8 @@ def render_segmentation_analysis():
         st.warning("⚠️ Please load NIfTI data first")
         return
     
-    data = st.session_state.nifti_data['data']
+    volume = st.session_state.nifti_data['data']
+    data = volume if isinstance(volume, ChunkedVolume) else volume.load()
     
     col1, col2 = st.columns([1, 2])
     
@@ -165,9 +168,10 @@ def render_segmentation_analysis():
                             ["threshold", "watershed", "region_growing"])
         
         if method == "threshold":
+            summary = summarize_volume(volume)
             threshold = st.slider("Threshold Value", 
-                                float(data.min()), float(data.max()), 
-                                float(np.percentile(data, 90)))
+                                summary.min, summary.max, 
+                                summary.percentile(90))
         
         if st.button("Perform Segmentation"):
             if method == "threshold":
@@ -175,35 +179,39 @@ def render_segmentation_analysis():
             else:
                 segmented = segment_regions(data, method)
             
-            st.session_state.segmented_data = segmented
+            GOVERNOR.put(st.session_state.session_id, 'segmented_data', segmented)
             st.success("✅ Segmentation completed!")
     
     with col2:
-        if 'segmented_data' in st.session_state:
-            segmented = st.session_state.segmented_data
+        segmented = GOVERNOR.get(st.session_state.session_id, 'segmented_data')
+        if segmented is not None:
             
             # Визуализация сегментации
             st.subheader("Segmentation Results")
             
             # Создаем 3D визуализацию сегментации
-            fig = create_3d_surface_plot(segmented.astype(float), isovalue=0.5, opacity=0.8)
+            if isinstance(segmented, ChunkedVolume):
+                # для больших объемов строим поверхность по прореженной копии
+                step = max(1, int(np.ceil((segmented.size / PREVIEW_VOXELS) ** (1 / 3))))
+                preview = segmented[::step, ::step, ::step]
+            else:
+                preview = segmented
+            fig = create_3d_surface_plot(preview.astype(np.float32), isovalue=0.5, opacity=0.8)
             if fig:
                 st.plotly_chart(fig, use_container_width=True)
             
             # Статистики сегментации
-            unique_labels = np.unique(segmented)
+            label_counts = count_labels(segmented)
             st.subheader("Segmentation Statistics")
             
             stats_data = []
-            for label in unique_labels:
+            for label, voxels in label_counts.items():
                 if label > 0:  # Исключаем фон
-                    mask = segmented == label
-                    volume = np.sum(mask)
                     stats_data.append({
                         'Label': int(label),
-                        'Volume (voxels)': volume,
-                        'Volume (mm³)': volume * 1.0,  # Предполагаем 1mm³ на воксель
-                        'Percentage': volume / segmented.size * 100
+                        'Volume (voxels)': voxels,
+                        'Volume (mm³)': voxels * 1.0,  # Предполагаем 1mm³ на воксель
+                        'Percentage': voxels / segmented.size * 100
                     })
             
             if stats_data:
@@ -237,7 +245,7 @@ def render_roi_analysis():
             roi_stats, roi_data = create_roi_analysis(data, roi_coords, roi_size)
             
             st.session_state.roi_stats = roi_stats
-            st.session_state.roi_data = roi_data
+            GOVERNOR.put(st.session_state.session_id, 'roi_data', roi_data)
             st.session_state.roi_coords = roi_coords
             
             st.success("✅ ROI analysis completed!")
@@ -248,7 +256,7 @@ def render_roi_analysis():
             
             # Отображаем статистики ROI
             stats = st.session_state.roi_stats
-            roi_data = st.session_state.roi_data
+            roi_data = GOVERNOR.get(st.session_state.session_id, 'roi_data')
             
             col_a, col_b = st.columns(2)
             with col_a:
@@ -404,10 +412,10 @@ def render_export_report():
         if 'nifti_data' in st.session_state:
             available_data.append("NIfTI Data")
         
-        if 'processed_data' in st.session_state:
+        if GOVERNOR.has(st.session_state.session_id, 'processed_data'):
             available_data.append("Processed Data")
         
-        if 'segmented_data' in st.session_state:
+        if GOVERNOR.has(st.session_state.session_id, 'segmented_data'):
             available_data.append("Segmented Data")
         
         if 'roi_stats' in st.session_state:
@@ -425,6 +433,19 @@ def render_export_report():
         else:
             st.write("No data available for export")
 
+def count_labels(segmented):
+    """Voxel count per label, read block by block for chunked results"""
+    if isinstance(segmented, ChunkedVolume):
+        counts = {}
+        for _, block in segmented.iter_blocks():
+            labels, block_counts = np.unique(block, return_counts=True)
+            for label, count in zip(labels, block_counts):
+                counts[label] = counts.get(label, 0) + int(count)
+        return dict(sorted(counts.items()))
+
+    labels, label_counts = np.unique(segmented, return_counts=True)
+    return {label: int(count) for label, count in zip(labels, label_counts)}
+
 # Функция для запуска расширенных функций
 def run_advanced_features():
     """Main function to run advanced features"""
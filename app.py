@@ -19,6 +19,12 @@ sys.path.append(str(current_dir))
 
 from pages import *
 from advanced_features import run_advanced_features
+from upload_cache import UPLOAD_CACHE
+from memo import MEMO_CACHE
+from memory_governor import GOVERNOR
+from sessions import SESSIONS
+from pyramid import PYRAMIDS
+from mesh_precompute import ISO_MESHES
 
 def main():
 
@@ -74,6 +80,30 @@ def main():
     
     for status in data_status:
         st.sidebar.markdown(status)
+
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("### ⚡ Computation Cache")
+    cache_stats = MEMO_CACHE.stats()
+    st.sidebar.markdown(
+        f"Hits: {cache_stats['hits']} · Misses: {cache_stats['misses']} "
+        f"({cache_stats['hit_rate']:.0%} hit rate)"
+    )
+    st.sidebar.progress(
+        min(1.0, cache_stats['used_bytes'] / cache_stats['budget_bytes']),
+        text=f"{cache_stats['used_bytes'] / 1024**2:.1f} / {cache_stats['budget_bytes'] / 1024**2:.0f} MB",
+    )
+
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("### 🧮 Memory")
+    for label, usage in [
+        ("This session", GOVERNOR.usage(st.session_state.session_id)),
+        ("All sessions", GOVERNOR.usage()),
+    ]:
+        st.sidebar.progress(
+            min(1.0, usage['resident_bytes'] / usage['budget_bytes']),
+            text=f"{label}: {usage['resident_bytes'] / 1024**2:.0f} / {usage['budget_bytes'] / 1024**2:.0f} MB"
+                 f" ({usage['spilled_bytes'] / 1024**2:.0f} MB on disk)",
+        )
     
     if "Home" in page:
         render_home_page()
@@ -87,6 +117,9 @@ def main():
         render_statistics_page()
     elif "Advanced Features" in page:
         run_advanced_features()
+
+    # Страница могла загрузить объем целиком: возвращаемся в бюджет
+    GOVERNOR.enforce(st.session_state.session_id)
     
     st.markdown("---")
     st.markdown("""
@@ -145,16 +178,12 @@ def render_statistics_page():
     render_statistics_content()
 
 def cleanup_temp_files():
-    if 'data_dir' in st.session_state and st.session_state.data_dir:
-        if os.path.exists(st.session_state.data_dir):
-            shutil.rmtree(st.session_state.data_dir)
-    
-    temp_files = list(Path('.').glob('temp_*'))
-    for temp_file in temp_files:
-        if temp_file.is_file():
-            temp_file.unlink()
-        elif temp_file.is_dir():
-            shutil.rmtree(temp_file)
+    SESSIONS.shutdown()
+    # Only uploads no other server process still references are deleted
+    UPLOAD_CACHE.shutdown()
+    GOVERNOR.shutdown()
+    PYRAMIDS.shutdown()
+    ISO_MESHES.shutdown()
 
 import atexit
 atexit.register(cleanup_temp_files)
@@ -0,0 +1,80 @@
+"""
+Header-only catalog of the NIfTI files in an extracted upload
+"""
+
+import json
+import os
+
+import nibabel as nib
+
+from ingest import is_nifti_name
+
+CATALOG_FILE_NAME = 'catalog.json'
+
+_loaded = {}
+
+
+def read_header_entry(path, root):
+    """Catalog entry for one file, reading only its NIfTI header"""
+    image = nib.load(path)
+    header = image.header
+    return {
+        'path': os.path.relpath(path, root),
+        'shape': [int(n) for n in image.shape],
+        'dtype': str(header.get_data_dtype()),
+        'voxel_size': [float(z) for z in header.get_zooms()],
+        'affine': image.affine.tolist(),
+        'file_size': os.path.getsize(path),
+        'compressed': path.lower().endswith('.gz'),
+    }
+
+
+def build_catalog(data_dir):
+    """Scan data_dir once, write catalog.json next to the files and return the entries"""
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(data_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if not is_nifti_name(name):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                entries.append(read_header_entry(path, data_dir))
+            except Exception as e:
+                entries.append({'path': os.path.relpath(path, data_dir), 'error': str(e)})
+
+    catalog_path = os.path.join(data_dir, CATALOG_FILE_NAME)
+    tmp_path = f'{catalog_path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, catalog_path)
+    return entries
+
+
+def load_catalog(data_dir):
+    """Catalog entries of data_dir with absolute 'file_path's, built on first use"""
+    catalog_path = os.path.join(data_dir, CATALOG_FILE_NAME)
+    if not os.path.exists(catalog_path):
+        build_catalog(data_dir)
+
+    mtime = os.path.getmtime(catalog_path)
+    cached = _loaded.get(catalog_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(catalog_path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        entry['file_path'] = os.path.join(data_dir, entry['path'])
+    _loaded[catalog_path] = (mtime, entries)
+    return entries
+
+
+def describe_entry(entry):
+    """One-line label for the file picker"""
+    if 'error' in entry:
+        return f"{entry['path']} (unreadable header)"
+    shape = '×'.join(str(n) for n in entry['shape'])
+    voxel = '×'.join(f'{z:g}' for z in entry['voxel_size'][:3])
+    size_mb = entry['file_size'] / (1024 * 1024)
+    return f"{entry['path']} — {shape} {entry['dtype']}, {voxel} mm, {size_mb:.1f} MB"
@@ -0,0 +1,329 @@
+"""
+Chunked out-of-core volume store for the Advanced Medical Visualization Tool
+"""
+
+import itertools
+import json
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from quantile_sketch import SKETCH_K, KLLSketch
+
+CHUNK_STORE_DIR = './temp_chunks'
+CHUNK_STORE_BYTES = 16 * 1024 * 1024 * 1024
+BLOCK_SHAPE = (64, 64, 64)
+BLOCK_CACHE_BYTES = 256 * 1024 * 1024
+OUT_OF_CORE_BYTES = 2 * 1024 * 1024 * 1024
+BLOCKS_FILE_NAME = 'blocks.dat'
+META_FILE_NAME = 'meta.json'
+SLAB_BYTES = 64 * 1024 * 1024
+
+
+_LIVE_STORES = weakref.WeakSet()
+
+
+def directory_bytes(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def evict_directories(root, max_bytes, keep=()):
+    """Remove least recently used store directories under root until they fit in max_bytes.
+
+    Directory mtimes are the LRU clock (stores are touched when opened);
+    staging directories and the paths in ``keep`` are left alone.
+    """
+    if not os.path.isdir(root):
+        return
+    keep = {os.path.abspath(path) for path in keep}
+    entries = [entry for entry in os.scandir(root) if entry.is_dir() and '.tmp-' not in entry.name]
+    sizes = {entry.path: directory_bytes(entry.path) for entry in entries}
+    total = sum(sizes.values())
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(entry.path) in keep:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        if not os.path.exists(entry.path):
+            total -= sizes[entry.path]
+
+
+def live_store_paths():
+    """Paths of the stores some ChunkedVolume in this process still has open"""
+    return [volume.path for volume in list(_LIVE_STORES)]
+
+
+def _normalize_key(key, shape):
+    """Per-axis index arrays and the axes to squeeze for a tuple of ints/slices"""
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        pos = next(i for i, k in enumerate(key) if k is Ellipsis)
+        key = key[:pos] + (slice(None),) * (len(shape) - len(key) + 1) + key[pos + 1:]
+    key = key + (slice(None),) * (len(shape) - len(key))
+    if len(key) > len(shape):
+        raise IndexError("too many indices for ChunkedVolume")
+
+    indices, squeeze = [], []
+    for axis, (k, n) in enumerate(zip(key, shape)):
+        if isinstance(k, (int, np.integer)):
+            k = int(k) + n if k < 0 else int(k)
+            if not 0 <= k < n:
+                raise IndexError(f"index {k} is out of bounds for axis {axis} with size {n}")
+            indices.append(np.array([k]))
+            squeeze.append(axis)
+        elif isinstance(k, slice):
+            indices.append(np.arange(*k.indices(n)))
+        else:
+            raise TypeError("ChunkedVolume supports integer and slice indexing only")
+    return indices, tuple(squeeze)
+
+
+class ChunkedVolume:
+    """3D volume stored on disk as fixed-size blocks.
+
+    Blocks are laid out contiguously in a single memory-mapped file of shape
+    ``grid + block_shape`` (edge blocks are zero padded), so reading one
+    block touches one contiguous run of bytes. Recently used blocks are kept
+    in an LRU cache bounded by ``cache_bytes``. Indexing with ints and
+    slices assembles the result from the blocks it intersects; :meth:`load`
+    promotes the whole volume to memory and should be reserved for data
+    that fits.
+    """
+
+    def __init__(self, path, mode='r', cache_bytes=BLOCK_CACHE_BYTES, temporary=False):
+        self.path = path
+        self.content_key = f'chunked:{os.path.abspath(path)}'
+        with open(os.path.join(path, META_FILE_NAME)) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.block_shape = tuple(meta['block_shape'])
+        self.grid = tuple(-(-n // b) for n, b in zip(self.shape, self.block_shape))
+        self.blocks = np.memmap(
+            os.path.join(path, BLOCKS_FILE_NAME), dtype=self.dtype, mode=mode,
+            shape=self.grid + self.block_shape
+        )
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        # whole-volume reductions (block_sketch) memoized per store
+        self.reductions = {}
+        _LIVE_STORES.add(self)
+        if temporary:
+            weakref.finalize(self, shutil.rmtree, path, True)
+
+    @classmethod
+    def create(cls, shape, dtype, path=None, block_shape=BLOCK_SHAPE, **kwargs):
+        """Allocate an empty (zero-filled) store; without a path it lives in a temporary directory"""
+        if path is None:
+            path = os.path.join(CHUNK_STORE_DIR, uuid.uuid4().hex)
+            kwargs.setdefault('temporary', True)
+        os.makedirs(path, exist_ok=True)
+        block_shape = tuple(min(b, n) for b, n in zip(block_shape, shape))
+        with open(os.path.join(path, META_FILE_NAME), 'w') as f:
+            json.dump({'shape': list(shape), 'dtype': np.dtype(dtype).str, 'block_shape': list(block_shape)}, f)
+        grid = tuple(-(-n // b) for n, b in zip(shape, block_shape))
+        np.memmap(os.path.join(path, BLOCKS_FILE_NAME), dtype=dtype, mode='w+', shape=grid + block_shape).flush()
+        return cls(path, mode='r+', **kwargs)
+
+    @classmethod
+    def from_volume(cls, volume, path=None, block_shape=BLOCK_SHAPE):
+        """Copy a LazyVolume (or array) into a block store, one slab of blocks at a time"""
+        if path is not None and os.path.exists(os.path.join(path, META_FILE_NAME)):
+            os.utime(path)
+            return cls(path)
+
+        staging = None if path is None else f'{path}.tmp-{os.getpid()}'
+        store = cls.create(volume.shape, volume.dtype, staging, block_shape)
+        depth = store.block_shape[2]
+        for bz, z0 in enumerate(range(0, volume.shape[2], depth)):
+            slab = np.asarray(volume[:, :, z0:z0 + depth])
+            for bx, by in itertools.product(range(store.grid[0]), range(store.grid[1])):
+                region = store.block_region((bx, by, bz))
+                store.write_block((bx, by, bz), slab[region[0], region[1], :])
+        store.blocks.flush()
+        if path is None:
+            return store
+
+        del store
+        try:
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        # постоянные копии больших томов: держим хранилище в пределах CHUNK_STORE_BYTES
+        evict_directories(os.path.dirname(path), CHUNK_STORE_BYTES, keep=live_store_paths() + [path])
+        return cls(path)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def is_loaded(self):
+        return False
+
+    @property
+    def resident_bytes(self):
+        return self._cached_bytes
+
+    def release(self):
+        """Drop the cached blocks"""
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def __repr__(self):
+        return f"ChunkedVolume({self.path!r}, shape={self.shape}, blocks={self.block_shape})"
+
+    def block_region(self, index):
+        """Global slices covered by block ``index`` (clipped to the volume)"""
+        return tuple(
+            slice(i * b, min((i + 1) * b, n))
+            for i, b, n in zip(index, self.block_shape, self.shape)
+        )
+
+    def block_indices(self):
+        return itertools.product(*(range(g) for g in self.grid))
+
+    def block(self, index):
+        """Block ``index`` as an in-memory array without edge padding"""
+        index = tuple(index)
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+
+        region = self.block_region(index)
+        inner = tuple(slice(0, r.stop - r.start) for r in region)
+        block = np.array(self.blocks[index][inner])
+        block.flags.writeable = False
+
+        with self._lock:
+            self._cache[index] = block
+            self._cached_bytes += block.nbytes
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self._cached_bytes -= old.nbytes
+        return block
+
+    def write_block(self, index, data):
+        index = tuple(index)
+        inner = tuple(slice(0, n) for n in data.shape)
+        self.blocks[index][inner] = data
+        with self._lock:
+            old = self._cache.pop(index, None)
+            if old is not None:
+                self._cached_bytes -= old.nbytes
+
+    def iter_blocks(self):
+        """Yield ``(region, block)`` for every block"""
+        for index in self.block_indices():
+            yield self.block_region(index), self.block(index)
+
+    def read_region(self, region):
+        """Read a box given as a tuple of step-1 slices"""
+        return self[tuple(region)]
+
+    def __getitem__(self, key):
+        indices, squeeze = _normalize_key(key, self.shape)
+        out = np.empty(tuple(len(idx) for idx in indices), dtype=self.dtype)
+        if out.size == 0:
+            return out.squeeze(axis=squeeze)
+
+        block_ranges = [
+            range(idx.min() // b, idx.max() // b + 1)
+            for idx, b in zip(indices, self.block_shape)
+        ]
+        for index in itertools.product(*block_ranges):
+            positions, local = [], []
+            for idx, i, b in zip(indices, index, self.block_shape):
+                mask = (idx >= i * b) & (idx < (i + 1) * b)
+                positions.append(np.nonzero(mask)[0])
+                local.append(idx[mask] - i * b)
+            if any(len(p) == 0 for p in positions):
+                continue
+            out[np.ix_(*positions)] = self.block(index)[np.ix_(*local)]
+        return out.squeeze(axis=squeeze)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.load()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def slice(self, axis, index):
+        """Read a single plane perpendicular to ``axis``"""
+        key = [slice(None)] * self.ndim
+        key[axis] = index
+        return self[tuple(key)]
+
+    def slab(self, axis, start, stop):
+        key = [slice(None)] * self.ndim
+        key[axis] = slice(start, stop)
+        return self[tuple(key)]
+
+    def iter_slabs(self, axis=-1, max_bytes=SLAB_BYTES):
+        """Yield ``(start, slab)`` pairs, aligned to block boundaries along ``axis``"""
+        axis = axis % self.ndim
+        plane_bytes = max(1, self.nbytes // self.shape[axis])
+        depth = self.block_shape[axis]
+        step = depth * max(1, max_bytes // (plane_bytes * depth))
+        for start in range(0, self.shape[axis], step):
+            yield start, self.slab(axis, start, min(start + step, self.shape[axis]))
+
+    def load(self):
+        """Assemble the full volume in memory"""
+        return self[...]
+
+    def map_blocks(self, fn, halo=0, dtype=None, path=None):
+        """New store holding fn applied block by block.
+
+        Each call sees the block grown by ``halo`` voxels on every side
+        (clipped to the volume), so neighbourhood filters are exact at block
+        seams; only the block's own voxels are kept from the result.
+        """
+        out = None
+        for index in self.block_indices():
+            region = self.block_region(index)
+            padded = tuple(slice(max(0, r.start - halo), min(n, r.stop + halo)) for r, n in zip(region, self.shape))
+            result = np.asarray(fn(self.read_region(padded)))
+            inner = tuple(slice(r.start - p.start, r.stop - p.start) for r, p in zip(region, padded))
+            if out is None:
+                out = ChunkedVolume.create(self.shape, dtype or result.dtype, path, self.block_shape)
+            out.write_block(index, result[inner].astype(out.dtype, copy=False))
+        out.blocks.flush()
+        return out
+
+
+def chunk_store_path(file_path):
+    """Persistent store location for a source file, keyed by its path, size and mtime"""
+    st = os.stat(file_path)
+    ident = f'{os.path.abspath(file_path)}:{st.st_size}:{st.st_mtime_ns}'
+    return os.path.join(CHUNK_STORE_DIR, uuid.uuid5(uuid.NAMESPACE_URL, ident).hex)
+
+
+def block_sketch(volume, k=SKETCH_K):
+    """KLL quantile sketch of every voxel, fed one block at a time"""
+    key = ('sketch', k)
+    if key not in volume.reductions:
+        sketch = KLLSketch(k)
+        for _, block in volume.iter_blocks():
+            sketch.update(block)
+        volume.reductions[key] = sketch
+    return volume.reductions[key]
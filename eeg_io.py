@@ -0,0 +1,171 @@
+"""
+Lazy EEG recording access for the Advanced Medical Visualization Tool
+"""
+
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import mne
+
+WINDOW_CACHE_BYTES = 64 * 1024 * 1024
+COLUMNS_DIR_NAME = 'columns'
+COLUMNS_META_NAME = 'columns.json'
+CONVERT_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def write_columns(raw, columns_dir, chunk_bytes=CONVERT_CHUNK_BYTES):
+    """Write every channel of raw as a contiguous float32 .npy file under columns_dir.
+
+    The EDF is read once, in time chunks spanning all channels, which is
+    the access pattern its record-interleaved layout favours.
+    """
+    staging = f'{columns_dir}.tmp-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    n_times = int(raw.n_times)
+    files = [f'ch{idx:04d}.npy' for idx in range(len(raw.ch_names))]
+    columns = [
+        np.lib.format.open_memmap(os.path.join(staging, name), mode='w+', dtype=np.float32, shape=(n_times,))
+        for name in files
+    ]
+    step = max(1, chunk_bytes // (8 * len(files)))
+    for start in range(0, n_times, step):
+        stop = min(start + step, n_times)
+        block = raw[:, start:stop][0]
+        for idx, column in enumerate(columns):
+            column[start:stop] = block[idx]
+    for column in columns:
+        column.flush()
+    del columns
+
+    sfreq = float(raw.info['sfreq'])
+    meta = {
+        'ch_names': list(raw.ch_names),
+        'files': files,
+        'n_times': n_times,
+        'sfreq': sfreq,
+        # MNE exposes every EDF channel at the common info['sfreq']
+        'sampling_rates': {ch: sfreq for ch in raw.ch_names},
+    }
+    with open(os.path.join(staging, COLUMNS_META_NAME), 'w') as f:
+        json.dump(meta, f)
+
+    try:
+        os.rename(staging, columns_dir)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(columns_dir):
+            raise
+
+
+def read_columns(columns_dir):
+    """Metadata and read-only memory maps of a columnar cache written by write_columns"""
+    with open(os.path.join(columns_dir, COLUMNS_META_NAME)) as f:
+        meta = json.load(f)
+    columns = [np.load(os.path.join(columns_dir, name), mmap_mode='r') for name in meta['files']]
+    return meta, columns
+
+
+class EEGRecording:
+    """EDF recording opened with ``preload=False``.
+
+    Exposes the parts of the MNE Raw interface the pages use (``ch_names``,
+    ``info``, ``times``) and serves channel/time windows read straight from
+    the file. Recently read windows are kept in a small LRU cache bounded by
+    bytes, so scrubbing the time slider does not hit the disk again.
+
+    Once a columnar cache is attached (see :meth:`build_columns`), windows
+    are sliced from per-channel float32 memory maps instead, touching only
+    the bytes of the requested channel.
+    """
+
+    def __init__(self, raw, cache_bytes=WINDOW_CACHE_BYTES, columns_dir=None):
+        self.raw = raw
+        self.content_key = None
+        if raw.filenames and raw.filenames[0] is not None:
+            st = os.stat(raw.filenames[0])
+            self.content_key = f'edf:{os.path.abspath(raw.filenames[0])}:{st.st_size}:{st.st_mtime_ns}'
+        self.cache_bytes = cache_bytes
+        self.columns = None
+        self.columns_meta = None
+        self._windows = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        if columns_dir is not None and os.path.isdir(columns_dir):
+            self.attach_columns(columns_dir)
+
+    @classmethod
+    def from_edf(cls, file_path, **kwargs):
+        """Open an EDF, picking up a columnar cache left next to it by an earlier conversion"""
+        kwargs.setdefault('columns_dir', os.path.join(os.path.dirname(file_path), COLUMNS_DIR_NAME))
+        return cls(mne.io.read_raw_edf(file_path, preload=False, verbose='error'), **kwargs)
+
+    @property
+    def has_columns(self):
+        return self.columns is not None
+
+    def attach_columns(self, columns_dir):
+        self.columns_meta, self.columns = read_columns(columns_dir)
+
+    def build_columns(self, columns_dir):
+        """Convert the recording to a columnar float32 cache (once) and serve windows from it"""
+        if not os.path.isdir(columns_dir):
+            write_columns(self.raw, columns_dir)
+        self.attach_columns(columns_dir)
+
+    @property
+    def ch_names(self):
+        return self.raw.ch_names
+
+    @property
+    def info(self):
+        return self.raw.info
+
+    @property
+    def times(self):
+        return self.raw.times
+
+    @property
+    def n_times(self):
+        return self.raw.n_times
+
+    @property
+    def duration(self):
+        return float(self.raw.times[-1])
+
+    def sample_range(self, time_range=None):
+        """Sample indices [start, stop) covering time_range in seconds"""
+        if time_range is None:
+            return 0, self.n_times
+        start, stop = self.raw.time_as_index(list(time_range), use_rounding=True)
+        return int(start), max(int(stop), int(start) + 1)
+
+    def window(self, channel_name, time_range=None):
+        """Samples and times of one channel over time_range (the whole recording if None)"""
+        channel_idx = self.ch_names.index(channel_name)
+        start, stop = self.sample_range(time_range)
+        if self.columns is not None:
+            return np.asarray(self.columns[channel_idx][start:stop]), self.raw.times[start:stop]
+
+        key = (channel_idx, start, stop)
+
+        with self._lock:
+            if key in self._windows:
+                self._windows.move_to_end(key)
+                return self._windows[key]
+
+        data, times = self.raw[channel_idx, start:stop]
+        window = (data[0], times)
+
+        with self._lock:
+            self._windows[key] = window
+            self._cached_bytes += data.nbytes + times.nbytes
+            while self._cached_bytes > self.cache_bytes and len(self._windows) > 1:
+                _, (old_data, old_times) = self._windows.popitem(last=False)
+                self._cached_bytes -= old_data.nbytes + old_times.nbytes
+        return window
@@ -0,0 +1,74 @@
+"""
+Upload ingestion for the Advanced Medical Visualization Tool
+"""
+
+import os
+import shutil
+import zipfile
+
+NIFTI_SUFFIXES = ('.nii.gz', '.nii')
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def is_nifti_name(name):
+    return name.lower().endswith(NIFTI_SUFFIXES)
+
+
+class NiftiArchive:
+    """ZIP upload opened straight from its in-memory buffer.
+
+    The central directory is read once when the archive is opened; only
+    NIfTI members are ever decompressed, and they are streamed to disk in
+    fixed-size chunks instead of going through ``extractall``.
+    """
+
+    def __init__(self, uploaded_file):
+        uploaded_file.seek(0)
+        self.name = getattr(uploaded_file, 'name', None)
+        self.archive = zipfile.ZipFile(uploaded_file, 'r')
+        self.members = [
+            info for info in self.archive.infolist()
+            if not info.is_dir()
+            and is_nifti_name(info.filename)
+            and not info.filename.startswith('__MACOSX/')
+        ]
+
+    @property
+    def has_nifti(self):
+        return bool(self.members)
+
+    @property
+    def nifti_bytes(self):
+        """Uncompressed size of the NIfTI members"""
+        return sum(info.file_size for info in self.members)
+
+    def member_path(self, info, extract_path):
+        """Destination of a member under extract_path, rejecting paths that escape it"""
+        root = os.path.abspath(extract_path)
+        target = os.path.abspath(os.path.join(root, info.filename))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"Unsafe path in archive: {info.filename}")
+        return target
+
+    def extract_nifti(self, extract_path):
+        """Stream every NIfTI member to extract_path and return the written paths"""
+        os.makedirs(extract_path, exist_ok=True)
+        paths = []
+        for info in self.members:
+            target = self.member_path(info, extract_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with self.archive.open(info) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+            paths.append(target)
+        return paths
+
+    def close(self):
+        self.archive.close()
+
+
+def open_nifti_archive(uploaded_file):
+    """Open an uploaded ZIP, or return None if it is not a readable archive"""
+    try:
+        return NiftiArchive(uploaded_file)
+    except (zipfile.BadZipFile, OSError):
+        return None
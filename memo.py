@@ -0,0 +1,155 @@
+"""
+Memoization of volume and EEG computations for the Advanced Medical Visualization Tool
+"""
+
+import functools
+import hashlib
+import inspect
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+MEMO_BUDGET_BYTES = 512 * 1024 * 1024
+
+_array_digests = {}
+
+
+def array_digest(array):
+    """Content digest of an array; read-only arrays are hashed once and remembered"""
+    cached = _array_digests.get(id(array))
+    if cached is not None and cached[0]() is array:
+        return cached[1]
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{array.shape}:{array.dtype.str}'.encode())
+    digest.update(np.ascontiguousarray(array).view(np.uint8).ravel())
+    value = digest.hexdigest()
+    if not array.flags.writeable:
+        key = id(array)
+        _array_digests[key] = (weakref.ref(array, lambda _: _array_digests.pop(key, None)), value)
+    return value
+
+
+def dataset_key(data):
+    """Stable identity of a dataset.
+
+    Volumes and recordings backed by files expose ``content_key`` (the
+    upload cache already names their files by content hash); plain arrays
+    are keyed by a digest of their bytes.
+    """
+    key = getattr(data, 'content_key', None)
+    if key is not None:
+        return key
+    if isinstance(data, np.ndarray):
+        return f'array:{array_digest(data)}'
+    raise TypeError(f"Cannot derive a dataset key for {type(data).__name__}")
+
+
+def sizeof(value):
+    """Approximate bytes held by a cached result"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class MemoCache:
+    """Results keyed by (function, dataset key, parameters), evicted least recently used first.
+
+    The cache holds at most ``budget_bytes`` of results; a result larger
+    than the whole budget is returned but not stored. Hit, miss and
+    eviction counters are kept for the status panel.
+    """
+
+    def __init__(self, budget_bytes=MEMO_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.used_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        size = sizeof(value)
+        if size > self.budget_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.used_bytes += size
+            self._evict()
+        return value
+
+    def _evict(self):
+        while self.used_bytes > self.budget_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.used_bytes -= size
+            self.evictions += 1
+
+    def resize(self, budget_bytes):
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+            'used_bytes': self.used_bytes,
+            'budget_bytes': self.budget_bytes,
+        }
+
+
+MEMO_CACHE = MemoCache()
+
+
+def memoize(func=None, cache=None):
+    """Cache func(data, *args, **kwargs) by dataset_key(data) and the remaining arguments.
+
+    Arguments are bound to the signature with defaults applied, so
+    ``f(data, 0.5)``, ``f(data, 0.5, 1)`` and ``f(data, isovalue=0.5)`` share
+    one entry when 1 is the default.
+    """
+    if func is None:
+        return functools.partial(memoize, cache=cache)
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(data, *args, **kwargs):
+        bound = signature.bind(data, *args, **kwargs)
+        bound.apply_defaults()
+        params = list(bound.arguments.items())[1:]
+        key = (func.__qualname__, dataset_key(data), repr(params))
+        target = MEMO_CACHE if cache is None else cache
+        return target.get_or_compute(key, lambda: func(data, *args, **kwargs))
+
+    return wrapper
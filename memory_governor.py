@@ -0,0 +1,157 @@
+"""
+Per-session memory accounting with spill-to-disk for the Advanced Medical Visualization Tool
+"""
+
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+SPILL_DIR = './temp_spill'
+SESSION_BUDGET_BYTES = 1024 * 1024 * 1024
+PROCESS_BUDGET_BYTES = 4 * 1024 * 1024 * 1024
+
+
+def resident_bytes(value):
+    """Bytes a tracked value currently holds in memory"""
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return int(getattr(value, 'resident_bytes', 0))
+
+
+def resident_key(value):
+    """Identity of the memory behind a value, so buffers shared between sessions are counted once"""
+    if isinstance(value, np.ndarray):
+        while isinstance(value.base, np.ndarray):
+            value = value.base
+        return id(value)
+    return getattr(value, 'resident_key', id(value))
+
+
+class MemoryGovernor:
+    """Tracks the large values each session keeps and spills the least recently used ones.
+
+    Plain arrays are owned by the governor: when a session or the whole
+    process goes over budget they are written to ``.npy`` files under
+    ``spill_dir`` and served back as read-only memory maps by :meth:`get`.
+    Volumes and recordings (anything with ``resident_bytes`` and
+    ``release()``) are only referenced; spilling them calls ``release()``,
+    which drops their in-memory copy in favour of reads from their files.
+    Values sharing a buffer (same ``resident_key``) are counted once.
+    """
+
+    def __init__(self, session_budget=SESSION_BUDGET_BYTES, process_budget=PROCESS_BUDGET_BYTES,
+                 spill_dir=SPILL_DIR):
+        self.session_budget = session_budget
+        self.process_budget = process_budget
+        self.spill_dir = spill_dir
+        self.spills = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def put(self, session_id, name, value):
+        """Track value as ``name`` of a session, replacing (and discarding) a previous one"""
+        with self._lock:
+            self.discard(session_id, name)
+            self._entries[(session_id, name)] = {'value': value, 'spill_path': None}
+            self.enforce(session_id)
+
+    def get(self, session_id, name, default=None):
+        """Tracked value; spilled arrays come back as read-only memory maps"""
+        with self._lock:
+            entry = self._entries.get((session_id, name))
+            if entry is None:
+                return default
+            self._entries.move_to_end((session_id, name))
+            return entry['value']
+
+    def has(self, session_id, name):
+        return (session_id, name) in self._entries
+
+    def discard(self, session_id, name):
+        with self._lock:
+            entry = self._entries.pop((session_id, name), None)
+            if entry is not None and entry['spill_path'] is not None:
+                entry['value'] = None
+                self._remove_file(entry['spill_path'])
+
+    def release_session(self, session_id):
+        """Forget every value of a session and delete its spill files"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session_id]:
+                self.discard(*key)
+
+    def shutdown(self):
+        with self._lock:
+            for key in list(self._entries):
+                self.discard(*key)
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def _remove_file(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            # the memory map may still be open elsewhere (Windows); the directory is removed at shutdown
+            pass
+
+    def _spill(self, key, entry):
+        value = entry['value']
+        if isinstance(value, np.ndarray):
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, f'{key[0]}-{key[1]}-{uuid.uuid4().hex}.npy')
+            np.save(path, value)
+            entry['value'] = np.load(path, mmap_mode='r')
+            entry['spill_path'] = path
+        elif hasattr(value, 'release'):
+            value.release()
+        self.spills += 1
+
+    def _resident(self, session_id=None):
+        sizes = {}
+        for key, entry in self._entries.items():
+            if session_id is None or key[0] == session_id:
+                value = entry['value']
+                sizes[resident_key(value)] = max(sizes.get(resident_key(value), 0), resident_bytes(value))
+        return sum(sizes.values())
+
+    def enforce(self, session_id=None):
+        """Spill least recently used values until the session and the process are within budget"""
+        with self._lock:
+            if session_id is not None:
+                self._spill_until(session_id, self.session_budget)
+            self._spill_until(None, self.process_budget)
+
+    def _spill_until(self, session_id, budget):
+        used = self._resident(session_id)
+        for key, entry in list(self._entries.items()):
+            if used <= budget:
+                break
+            if session_id is not None and key[0] != session_id:
+                continue
+            if resident_bytes(entry['value']):
+                self._spill(key, entry)
+                used = self._resident(session_id)
+
+    def usage(self, session_id=None):
+        """Resident and spilled bytes of a session (or the whole process if None)"""
+        with self._lock:
+            entries = [
+                entry for key, entry in self._entries.items()
+                if session_id is None or key[0] == session_id
+            ]
+            return {
+                'entries': len(entries),
+                'resident_bytes': self._resident(session_id),
+                'spilled_bytes': sum(
+                    entry['value'].nbytes for entry in entries if entry['spill_path'] is not None
+                ),
+                'budget_bytes': self.process_budget if session_id is None else self.session_budget,
+            }
+
+
+GOVERNOR = MemoryGovernor()
@@ -0,0 +1,190 @@
+"""
+Background precomputation of preview isosurfaces across the isovalue slider
+"""
+
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from skimage import measure
+
+from memo import dataset_key
+from mesh_simplify import decimate_mesh
+from sessions import SESSIONS
+from utils import display_mesh, padded_render_grid
+from volume_summary import summarize_volume
+
+ISO_PREVIEW_DIR = './temp_iso_previews'
+ISO_PREVIEW_VOXELS = 96 ** 3
+ISO_PREVIEW_FACES = 50_000
+ISO_PREVIEW_LEVELS = tuple(np.round(np.arange(0.05, 1.0, 0.05), 2))
+ISO_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def preview_mesh(grid_path, level, factor, origin, max_faces=ISO_PREVIEW_FACES):
+    """Decimated marching-cubes mesh of a saved preview grid, in full-resolution voxel coordinates.
+
+    Runs in a worker process; returns None when the level is outside the grid's range.
+    """
+    grid = np.load(grid_path)
+    try:
+        verts, faces, _, _ = measure.marching_cubes(grid, level=level)
+    except (ValueError, RuntimeError):
+        return None
+    verts = verts * factor + np.asarray(origin)
+    return decimate_mesh(verts, faces, max_faces)
+
+
+class IsosurfacePrecomputer:
+    """Low-resolution meshes at quantized isovalues, built in a process pool once a volume is loaded.
+
+    Each volume is reduced once (cropped, block-mean, see
+    padded_render_grid) and saved for the workers; isovalues nearest the
+    slider default are queued first. The page shows the nearest finished
+    mesh while :meth:`exact` builds the requested one in a background
+    thread. Previews are kept only while some session holds the volume.
+    """
+
+    def __init__(self, workers=ISO_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._planner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='iso-precompute')
+        self._exact = ThreadPoolExecutor(max_workers=1, thread_name_prefix='iso-exact')
+        self._jobs = {}
+        self._exact_jobs = {}
+        self._exact_owners = {}
+        self._holders = {}
+        self._grid_paths = {}
+        self._lock = threading.Lock()
+
+    def _process_pool(self):
+        if self._pool is None:
+            # spawn: не форкаем процесс сервера вместе с его потоками
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def start(self, volume, session_id, isovalues=ISO_PREVIEW_LEVELS):
+        """Queue preview meshes of volume (once per volume) on behalf of a session.
+
+        A session holds one volume at a time: the previews of the one it
+        loaded before are dropped if no other session holds them.
+        """
+        if getattr(volume, 'ndim', 0) != 3:
+            return
+        key = dataset_key(volume)
+        with self._lock:
+            for other_key, holders in list(self._holders.items()):
+                if other_key != key:
+                    holders.discard(session_id)
+            self._holders.setdefault(key, set()).add(session_id)
+            self._drop_unheld()
+            if key in self._jobs:
+                return
+            self._jobs[key] = {}
+        self._planner.submit(self._submit, volume, key, isovalues)
+
+    def _submit(self, volume, key, isovalues):
+        grid, origin, factor = padded_render_grid(volume, ISO_PREVIEW_VOXELS)
+
+        os.makedirs(ISO_PREVIEW_DIR, exist_ok=True)
+        grid_path = os.path.join(ISO_PREVIEW_DIR, f'{uuid.uuid5(uuid.NAMESPACE_URL, key).hex}.npy')
+        np.save(grid_path, grid)
+
+        summary = summarize_volume(volume)
+        value_range = (summary.max - summary.min) or 1.0
+        pool = self._process_pool()
+        with self._lock:
+            if key not in self._jobs:
+                # released while the grid was being built
+                self._remove_file(grid_path)
+                return
+            self._grid_paths[key] = grid_path
+            jobs = self._jobs[key]
+            for isovalue in sorted(isovalues, key=lambda iso: abs(iso - 0.5)):
+                level = summary.min + isovalue * value_range
+                jobs[float(isovalue)] = pool.submit(preview_mesh, grid_path, level, factor, origin)
+
+    def nearest(self, volume, isovalue):
+        """(isovalue, verts, faces) of the finished preview closest to isovalue, or None"""
+        with self._lock:
+            jobs = dict(self._jobs.get(dataset_key(volume), {}))
+        ready = [iso for iso, job in jobs.items()
+                 if job.done() and not job.cancelled() and job.exception() is None and job.result() is not None]
+        if not ready:
+            return None
+        best = min(ready, key=lambda iso: abs(iso - isovalue))
+        return (best, *jobs[best].result())
+
+    def exact(self, volume, session_id, isovalue, step_size=1):
+        """Future of display_mesh(volume, isovalue, step_size), computed in the background.
+
+        Jobs are shared by the sessions asking for the same mesh; each
+        session owns only its latest request, and a job no session owns any
+        more is cancelled if it has not started. A cancelled job is
+        resubmitted when asked for again.
+        """
+        job_key = (dataset_key(volume), float(isovalue), int(step_size))
+        with self._lock:
+            self._exact_owners[session_id] = job_key
+            self._drop_unowned()
+            job = self._exact_jobs.get(job_key)
+            if job is None or job.cancelled():
+                job = self._exact.submit(display_mesh, volume, *job_key[1:])
+                self._exact_jobs[job_key] = job
+            return job
+
+    def progress(self, volume):
+        """Fraction of the preview meshes of volume that are finished"""
+        with self._lock:
+            jobs = list(self._jobs.get(dataset_key(volume), {}).values())
+        return sum(job.done() for job in jobs) / len(jobs) if jobs else 0.0
+
+    def release_session(self, session_id):
+        """Forget a session's volume, dropping its previews if no other session holds it"""
+        with self._lock:
+            for holders in self._holders.values():
+                holders.discard(session_id)
+            self._exact_owners.pop(session_id, None)
+            self._drop_unheld()
+
+    def _drop_unheld(self):
+        for key in [key for key, holders in self._holders.items() if not holders]:
+            del self._holders[key]
+            for job in self._jobs.pop(key, {}).values():
+                job.cancel()
+            for session_id, job_key in list(self._exact_owners.items()):
+                if job_key[0] == key:
+                    del self._exact_owners[session_id]
+            grid_path = self._grid_paths.pop(key, None)
+            if grid_path is not None:
+                self._remove_file(grid_path)
+        self._drop_unowned()
+
+    def _drop_unowned(self):
+        owned = set(self._exact_owners.values())
+        for job_key in [job_key for job_key in self._exact_jobs if job_key not in owned]:
+            # a running job finishes; its mesh stays in the memo cache
+            self._exact_jobs.pop(job_key).cancel()
+
+    def _remove_file(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            # a worker may still have it open (Windows); the directory is removed at shutdown
+            pass
+
+    def shutdown(self):
+        self._planner.shutdown(wait=False, cancel_futures=True)
+        self._exact.shutdown(wait=False, cancel_futures=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(ISO_PREVIEW_DIR, ignore_errors=True)
+
+
+ISO_MESHES = IsosurfacePrecomputer()
+SESSIONS.register(ISO_MESHES)
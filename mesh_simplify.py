@@ -0,0 +1,82 @@
+"""
+Quadric-based decimation of marching-cubes meshes to a triangle budget
+"""
+
+import numpy as np
+
+MESH_FACE_BUDGET = 200_000
+MAX_DECIMATION_ROUNDS = 12
+
+
+def face_quadrics(verts, faces):
+    """Area-weighted plane quadric (4×4) of every face"""
+    v1, v2, v3 = (verts[faces[:, i]].astype(np.float64) for i in range(3))
+    normals = np.cross(v2 - v1, v3 - v1)
+    double_areas = np.linalg.norm(normals, axis=1)
+    valid = double_areas > 0
+    planes = np.zeros((len(faces), 4))
+    planes[valid, :3] = normals[valid] / double_areas[valid, None]
+    planes[:, 3] = -np.einsum('ij,ij->i', planes[:, :3], v1)
+    return 0.5 * double_areas[:, None, None] * planes[:, :, None] * planes[:, None, :]
+
+
+def cluster_mesh(verts, faces, cell_size, quadrics):
+    """Merge the vertices of each cubic cell into one at the point of least quadric error.
+
+    Every face adds its quadric to the cells of its three corners (vertex
+    clustering with quadric error metrics); the merged vertex minimizes the
+    summed plane distances, pulled slightly towards the cell centroid so
+    flat cells stay well posed, and is kept inside the cell.
+    """
+    cells = np.floor((verts - verts.min(axis=0)) / cell_size).astype(np.int64)
+    _, cell_of_vertex = np.unique(cells, axis=0, return_inverse=True)
+    cell_of_vertex = cell_of_vertex.ravel()
+    n_cells = int(cell_of_vertex.max()) + 1
+
+    new_faces = cell_of_vertex[faces]
+    keep = ((new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2])
+            & (new_faces[:, 0] != new_faces[:, 2]))
+    new_faces = new_faces[keep]
+    _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(first)]
+
+    counts = np.bincount(cell_of_vertex, minlength=n_cells)[:, None]
+    centroids = np.zeros((n_cells, 3))
+    np.add.at(centroids, cell_of_vertex, verts)
+    centroids /= counts
+    low = np.full((n_cells, 3), np.inf)
+    high = np.full((n_cells, 3), -np.inf)
+    np.minimum.at(low, cell_of_vertex, verts)
+    np.maximum.at(high, cell_of_vertex, verts)
+
+    cell_quadrics = np.zeros((n_cells, 4, 4))
+    for corner in range(3):
+        np.add.at(cell_quadrics, cell_of_vertex[faces[:, corner]], quadrics)
+    a = cell_quadrics[:, :3, :3]
+    b = cell_quadrics[:, :3, 3]
+    weight = 1e-3 * np.trace(a, axis1=1, axis2=2) / 3 + 1e-12
+    regularized = a + weight[:, None, None] * np.eye(3)
+    targets = weight[:, None] * centroids - b
+    points = np.linalg.solve(regularized, targets[:, :, None])[:, :, 0]
+    points = np.clip(points, low, high)
+
+    used, new_faces = np.unique(new_faces, return_inverse=True)
+    return points[used], new_faces.reshape(-1, 3)
+
+
+def decimate_mesh(verts, faces, max_faces=MESH_FACE_BUDGET):
+    """Mesh with at most max_faces triangles as float32 vertices and int32 faces"""
+    verts = np.asarray(verts, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    if len(faces) > max_faces:
+        quadrics = face_quadrics(verts, faces)
+        edges = verts[faces[:, 1]] - verts[faces[:, 0]]
+        # число треугольников поверхности убывает как квадрат размера ячейки
+        cell_size = np.linalg.norm(edges, axis=1).mean() * np.sqrt(len(faces) / max_faces)
+        for _ in range(MAX_DECIMATION_ROUNDS):
+            new_verts, new_faces = cluster_mesh(verts, faces, cell_size, quadrics)
+            if len(new_faces) <= max_faces:
+                break
+            cell_size *= 1.05 * np.sqrt(len(new_faces) / max_faces)
+        verts, faces = new_verts, new_faces
+    return verts.astype(np.float32), faces.astype(np.int32)
@@ -3,6 +3,7 @@ Page content functions for the Advanced Medical Visualization Tool
 """
 
 import streamlit as st
+import time
 import numpy as np
 import nibabel as nib
 import matplotlib.pyplot as plt
@@ -20,6 +21,20 @@ import mne
 from skimage import measure
 import pandas as pd
 from utils import *
+from prefetch import PREFETCH_AHEAD, PREFETCHER
+from volume_summary import summarize_volume
+from mesh_metrics import mesh_metrics
+from projections import PROJECTION_KINDS, PROJECTION_LABELS, compute_projections
+from slice_render import SLICE_COLORMAPS, default_window
+from memory_governor import GOVERNOR
+from sessions import SESSIONS
+from pyramid import PYRAMIDS
+from mesh_precompute import ISO_MESHES
+from point_cloud import sample_points
+from eeg_io import COLUMNS_DIR_NAME, EEGRecording
+from ingest import open_nifti_archive
+from catalog import build_catalog, describe_entry, load_catalog
+from upload_cache import UPLOAD_CACHE, EDF_FILE_NAME, content_hash, write_upload
 
 def render_upload_overview_page():
     col1, col2 = st.columns(2)
@@ -32,43 +47,62 @@ def render_upload_overview_page():
             if (st.session_state.uploaded_file != uploaded_nifti.name or 
                 st.session_state.data_dir is None):
                 
-                if does_zip_have_nifti(uploaded_nifti):
-                    data_dir = f'./temp_data_{get_random_string(10)}'
+                archive = open_nifti_archive(uploaded_nifti)
+                
+                if archive is not None and archive.has_nifti:
+                    data_dir = extract_zip(archive, uploaded_nifti)
                     
-                    if extract_zip(uploaded_nifti, data_dir):
+                    if data_dir:
+                        if st.session_state.data_dir != data_dir:
+                            # загруженный том читает файлы старой распаковки: убираем его до ее удаления
+                            unload_volume()
+                        release_upload(st.session_state.data_dir, keep=data_dir)
                         st.session_state.data_dir = data_dir
                         st.session_state.uploaded_file = uploaded_nifti.name
                         st.success("✅ NIfTI files uploaded and extracted successfully!")
                     else:
                         st.error("❌ Failed to extract ZIP file")
                 else:
+                    if archive is not None:
+                        archive.close()
                     st.error("❌ No NIfTI files found in the ZIP archive")
     
     with col2:
         st.subheader("Upload EEG Files (EDF)")
         uploaded_eeg = st.file_uploader("Choose an EDF file", type=['edf'], key="eeg_upload")
+        columnar_eeg = st.checkbox("Convert to columnar float32 cache (faster per-channel access)", value=True)
         
         if uploaded_eeg is not None:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.edf') as tmp_file:
-                tmp_file.write(uploaded_eeg.getvalue())
-                tmp_path = tmp_file.name
-            
-            try:
-                eeg_data = load_eeg_data(tmp_path)
+            if st.session_state.eeg_upload_id != (uploaded_eeg.name, uploaded_eeg.size):
+                eeg_dir, eeg_data = load_uploaded_eeg(uploaded_eeg, columnar=columnar_eeg)
                 if eeg_data is not None:
+                    release_upload(st.session_state.eeg_dir, keep=eeg_dir)
+                    st.session_state.eeg_dir = eeg_dir
+                    st.session_state.eeg_upload_id = (uploaded_eeg.name, uploaded_eeg.size)
                     st.session_state.eeg_data = eeg_data
                     st.success("✅ EEG data loaded successfully!")
-            finally:
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
     
     if st.session_state.data_dir and os.path.exists(st.session_state.data_dir):
-        nifti_files = glob(f'{st.session_state.data_dir}/**/*.nii.gz', recursive=True) + \
-                     glob(f'{st.session_state.data_dir}/**/*.nii', recursive=True)
+        catalog = load_catalog(st.session_state.data_dir)
         
-        if nifti_files:
+        if catalog:
             st.subheader("📊 Available NIfTI Files")
-            selected_file = st.selectbox("Select a file to analyze", nifti_files)
+            selected_entry = st.selectbox("Select a file to analyze", catalog, format_func=describe_entry)
+            selected_file = selected_entry['file_path']
+            
+            # Начинаем чтение выбранного файла (и следующих за ним) в фоне
+            position = catalog.index(selected_entry)
+            PREFETCHER.prefetch(
+                entry['file_path'] for entry in catalog[position:position + 1 + PREFETCH_AHEAD]
+                if 'error' not in entry
+            )
+            prefetch_progress = PREFETCHER.progress(selected_file)
+            if prefetch_progress < 1.0:
+                st.progress(prefetch_progress, text="Reading selected file in the background...")
+            
+            with st.expander(f"Catalog ({len(catalog)} files)"):
+                catalog_df = pd.DataFrame(catalog).drop(columns=['file_path', 'affine'], errors='ignore')
+                st.dataframe(catalog_df, use_container_width=True)
             
             if st.button("Load File"):
                 data, header, affine = load_nifti_file(selected_file)
@@ -77,8 +111,14 @@ def render_upload_overview_page():
                         'data': data,
                         'header': header,
                         'affine': affine,
-                        'file_path': selected_file
+                        'file_path': selected_file,
+                        'summary': summarize_volume(data)
                     }
+                    GOVERNOR.put(st.session_state.session_id, 'nifti_data', data)
+                    # пирамида уровней для просмотра срезов строится в фоне
+                    PYRAMIDS.request(data)
+                    # превью изоповерхностей для ползунка 3D страницы
+                    ISO_MESHES.start(data, st.session_state.session_id)
                     st.success("✅ File loaded successfully!")
 
                     stats = analyze_volume_statistics(data)
@@ -106,6 +146,7 @@ def render_upload_overview_page():
             st.write(f"**Channels:** {len(raw.ch_names)}")
             st.write(f"**Sampling Rate:** {raw.info['sfreq']} Hz")
             st.write(f"**Duration:** {raw.times[-1]:.1f} seconds")
+            st.write(f"**Storage:** {'columnar float32 cache' if raw.has_columns else 'EDF (on demand)'}")
         
         with col2:
             st.write("**Channel Names:**")
@@ -127,36 +168,46 @@ def render_3d_visualization_content():
             
             visualization_type = st.selectbox(
                 "Visualization Type",
-                ["3D Surface", "Volume Rendering", "Orthogonal Slices"]
+                ["3D Surface", "Volume Rendering", "Orthogonal Slices", "Intensity Projections"]
             )
             
             if visualization_type == "3D Surface":
                 isovalue = st.slider("Isosurface Value", 0.0, 1.0, 0.5, 0.01)
                 opacity = st.slider("Opacity", 0.0, 1.0, 0.7, 0.1)
+                step_size = st.select_slider("Mesh Step Size", options=[1, 2, 3, 4], value=1,
+                                             help="Marching cubes step in voxels; larger steps give faster, coarser previews")
+            elif visualization_type == "Intensity Projections":
+                projection_kind = st.selectbox("Projection", PROJECTION_KINDS,
+                                               format_func=PROJECTION_LABELS.get)
             
             if st.button("Generate Visualization"):
                 with st.spinner("Creating 3D visualization..."):
                     if visualization_type == "3D Surface":
-                        fig = create_3d_surface_plot(data, isovalue, opacity)
-                        if fig:
-                            st.plotly_chart(fig, use_container_width=True)
+                        # сама поверхность строится справа при каждом движении ползунка
+                        spacing = st.session_state.nifti_data['header'].get_zooms()[:3]
+                        render_mesh_metrics(*surface_mesh(data, isovalue, step_size), spacing)
                     
                     elif visualization_type == "Orthogonal Slices":
                         fig = create_orthogonal_slices(data)
                         st.plotly_chart(fig, use_container_width=True)
                     
+                    elif visualization_type == "Intensity Projections":
+                        fig = create_projection_figure(compute_projections(data), projection_kind)
+                        st.plotly_chart(fig, use_container_width=True)
+                    
                     elif visualization_type == "Volume Rendering":
-                        threshold = np.percentile(data, 95)
-                        x, y, z = np.where(data > threshold)
+                        threshold = st.session_state.nifti_data['summary'].percentile(95)
+                        # выборка из индекса вокселей, отсортированных по интенсивности
+                        x, y, z, values = sample_points(data, threshold)
                         
                         fig = go.Figure(data=[go.Scatter3d(
-                            x=x[::1000],
-                            y=y[::1000],
-                            z=z[::1000],
+                            x=x,
+                            y=y,
+                            z=z,
                             mode='markers',
                             marker=dict(
                                 size=2,
-                                color=data[x[::1000], y[::1000], z[::1000]],
+                                color=values,
                                 colorscale='viridis',
                                 opacity=0.6
                             )
@@ -174,7 +225,10 @@ def render_3d_visualization_content():
                         st.plotly_chart(fig, use_container_width=True)
         
         with col2:
-            st.info("💡 Use the controls on the left to customize your visualization")
+            if visualization_type == "3D Surface":
+                render_live_surface(data, isovalue, opacity, step_size)
+            else:
+                st.info("💡 Use the controls on the left to customize your visualization")
 
 def render_slice_analysis_content():
     
@@ -198,28 +252,56 @@ def render_slice_analysis_content():
             else:  # sagittal
                 slice_num = st.slider("Slice Number", 0, data.shape[0]-1, data.shape[0]//2)
             
+            slice_axis = {'sagittal': 0, 'coronal': 1, 'axial': 2}[slice_type]
+            
+            summary = st.session_state.nifti_data['summary']
+            window_level, window_width = default_window(summary)
+            if summary.max > summary.min:
+                value_span = summary.max - summary.min
+                window_level = st.slider("Window Level", summary.min, summary.max, float(window_level))
+                window_width = st.slider("Window Width", value_span / 1000, value_span,
+                                         float(min(window_width, value_span)))
+            else:
+                # постоянный объем: слайдеру нужен непустой диапазон
+                st.caption(f"Constant volume (value {summary.min:g}); window controls are disabled")
+            colormap = st.selectbox("Colormap", SLICE_COLORMAPS)
+            full_resolution = st.checkbox("Full Resolution (zoom)", value=False,
+                                          help="Render the slice from the full volume instead of a downsampled level")
+            
             show_histogram = st.checkbox("Show Histogram", value=True)
             show_orthogonal = st.checkbox("Show Orthogonal View", value=False)
+            show_projection = st.checkbox("Show Projection", value=False)
+            if show_projection:
+                projection_kind = st.selectbox("Projection", PROJECTION_KINDS,
+                                               format_func=PROJECTION_LABELS.get)
+                slab_thickness = st.slider("Slab Thickness (0 = whole volume)", 0, data.shape[slice_axis], 0)
         
         with col2:
-            if slice_type == "axial":
-                slice_data = data[:, :, slice_num]
-            elif slice_type == "coronal":
-                slice_data = data[:, slice_num, :]
-            else:  # sagittal
-                slice_data = data[slice_num, :, :]
-            
-            fig = px.imshow(slice_data, 
-                           color_continuous_scale='gray',
-                           title=f'{slice_type.capitalize()} Slice {slice_num}')
+            # срез рендерится на сервере в PNG, в браузер уходят только байты изображения
+            fig = create_slice_figure(data, slice_axis, slice_num, (window_level, window_width), colormap,
+                                      title=f'{slice_type.capitalize()} Slice {slice_num}',
+                                      full_resolution=full_resolution)
             st.plotly_chart(fig, use_container_width=True)
             
             if show_histogram:
-                hist_fig = px.histogram(x=slice_data.flatten(), 
-                                       title=f'Histogram - {slice_type.capitalize()} Slice {slice_num}',
-                                       nbins=50)
+                counts, edges = compute_histogram(data, bins=50, axis=slice_axis, index=slice_num)
+                hist_fig = create_histogram_chart(counts, edges,
+                                                  f'Histogram - {slice_type.capitalize()} Slice {slice_num}')
                 st.plotly_chart(hist_fig, use_container_width=True)
 
+            if show_projection:
+                box = None
+                title = f'{PROJECTION_LABELS[projection_kind]} - {slice_type.capitalize()}'
+                if slab_thickness:
+                    # толстый срез вокруг текущего
+                    start = slice_num - slab_thickness // 2
+                    box = tuple((start, start + slab_thickness) if axis == slice_axis else None
+                                for axis in range(3))
+                    title += f' Slab of {slab_thickness} around Slice {slice_num}'
+                projection = compute_projections(data, box)[slice_axis][projection_kind]
+                proj_fig = px.imshow(projection, color_continuous_scale='gray', title=title)
+                st.plotly_chart(proj_fig, use_container_width=True)
+
             if show_orthogonal:
                 ortho_fig = create_orthogonal_slices(data)
                 st.plotly_chart(ortho_fig, use_container_width=True)
@@ -252,12 +334,7 @@ def render_eeg_analysis_content():
 
             if show_spectrum:
                 try:
-                    channel_idx = raw.ch_names.index(channel)
-                    data, times = raw[channel_idx, :]
-                    
-                    from scipy import signal
-                    # data[0] извлекает данные канала из 2D массива
-                    freqs, psd = signal.welch(data[0], fs=raw.info['sfreq'], nperseg=1024)
+                    freqs, psd = compute_psd(raw, channel)
                     
                     spectrum_fig = go.Figure()
                     spectrum_fig.add_trace(go.Scatter(x=freqs, y=psd, mode='lines'))
@@ -298,28 +375,25 @@ def render_statistics_content():
         with col2:
             st.subheader("Data Distribution")
             
-            hist_fig = px.histogram(x=data.flatten(), 
-                                   title='Distribution of All Voxel Values',
-                                   nbins=100)
+            counts, edges = compute_histogram(data, bins=100)
+            hist_fig = create_histogram_chart(counts, edges, 'Distribution of All Voxel Values')
             hist_fig.update_layout(height=400)
             st.plotly_chart(hist_fig, use_container_width=True)
         
         st.subheader("Spatial Analysis")
         
         col1, col2, col3 = st.columns(3)
+        mean_x, mean_y, mean_z = compute_axis_means(data)
         
         with col1:
-            mean_x = np.mean(data, axis=(1, 2))
             fig_x = px.line(y=mean_x, title='Mean along X-axis')
             st.plotly_chart(fig_x, use_container_width=True)
         
         with col2:
-            mean_y = np.mean(data, axis=(0, 2))
             fig_y = px.line(y=mean_y, title='Mean along Y-axis')
             st.plotly_chart(fig_y, use_container_width=True)
         
         with col3:
-            mean_z = np.mean(data, axis=(0, 1))
             fig_z = px.line(y=mean_z, title='Mean along Z-axis')
             st.plotly_chart(fig_z, use_container_width=True)
 
@@ -333,66 +407,87 @@ def initialize_session_state():
         st.session_state.nifti_data = None
     if 'eeg_data' not in st.session_state:
         st.session_state.eeg_data = None
+    if 'eeg_dir' not in st.session_state:
+        st.session_state.eeg_dir = None
+    if 'eeg_upload_id' not in st.session_state:
+        st.session_state.eeg_upload_id = None
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = get_random_string(16)
+        # токен собирается вместе с состоянием сессии и освобождает ее общие ресурсы
+        st.session_state.session_token = SESSIONS.token(st.session_state.session_id)
 
 def get_random_string(length):
     return ''.join(random.choice(string.ascii_letters) for i in range(length))
 
 def does_zip_have_nifti(uploaded_file):
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_path = tmp_file.name
-    
-    try:
-        with zipfile.ZipFile(tmp_path, 'r') as zip_ref:
-            for file_name in zip_ref.namelist():
-                if file_name.endswith(('.nii.gz', '.nii')):
-                    return True
-        return False
-    except:
+    archive = open_nifti_archive(uploaded_file)
+    if archive is None:
         return False
+    try:
+        return archive.has_nifti
     finally:
-        if os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+        archive.close()
+
+def extract_zip(archive, uploaded_file):
+    """Extract the archive's NIfTI members into the shared upload cache and return the directory"""
+    def populate(path):
+        archive.extract_nifti(path)
+        build_catalog(path)
 
-def extract_zip(uploaded_file, extract_path):
-    os.makedirs(extract_path, exist_ok=True)
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_path = tmp_file.name
-    
     try:
-        with zipfile.ZipFile(tmp_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_path)
-        return True
+        key = content_hash(uploaded_file)
+        return UPLOAD_CACHE.acquire('data', key, st.session_state.session_id, populate)
     except Exception as e:
         st.error(f"Error extracting zip: {e}")
-        return False
+        return None
     finally:
-        if os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+        archive.close()
+
+def load_uploaded_eeg(uploaded_file, columnar=False):
+    """Load an EDF upload through the shared upload cache, optionally converting it to columns"""
+    try:
+        key = content_hash(uploaded_file)
+        eeg_dir = UPLOAD_CACHE.acquire(
+            'eeg', key, st.session_state.session_id,
+            lambda path: write_upload(uploaded_file, os.path.join(path, EDF_FILE_NAME))
+        )
+    except Exception as e:
+        st.error(f"Error storing EEG upload: {e}")
+        return None, None
+
+    eeg_data = UPLOAD_CACHE.parsed(eeg_dir, lambda: load_eeg_data(os.path.join(eeg_dir, EDF_FILE_NAME)))
+    if eeg_data is None:
+        UPLOAD_CACHE.release(eeg_dir, st.session_state.session_id)
+    elif columnar and not eeg_data.has_columns:
+        try:
+            with st.spinner("Converting EEG channels to columnar cache..."):
+                eeg_data.build_columns(os.path.join(eeg_dir, COLUMNS_DIR_NAME))
+        except Exception as e:
+            st.warning(f"Columnar cache unavailable, reading from EDF: {e}")
+    return eeg_dir, eeg_data
+
+def release_upload(path, keep=None):
+    """Drop this session's reference to a cached upload; it is deleted once no session uses it"""
+    if path and path != keep:
+        UPLOAD_CACHE.release(path, st.session_state.session_id)
+
+def unload_volume():
+    """Drop the session's volume and what is tracked for it, e.g. before its upload is released"""
+    st.session_state.nifti_data = None
+    GOVERNOR.discard(st.session_state.session_id, 'nifti_data')
+    ISO_MESHES.release_session(st.session_state.session_id)
 
 def load_nifti_file(file_path):
     try:
-        nii_img = nib.load(file_path)
-        data = nii_img.get_fdata()
-        header = nii_img.header
-        affine = nii_img.affine
-        return data, header, affine
+        with st.spinner("Loading volume..."):
+            return PREFETCHER.take(file_path)
     except Exception as e:
         st.error(f"Error loading NIfTI file: {e}")
         return None, None, None
 
 def load_eeg_data(file_path):
     try:
-        raw = mne.io.read_raw_edf(file_path, preload=True)
-        return raw
+        return EEGRecording.from_edf(file_path)
     except Exception as e:
         st.error(f"Error loading EEG data: {e}")
         return None
@@ -403,28 +498,10 @@ def create_eeg_plot(raw, channel_name=None, time_range=None):
         if channel_name is None:
             channel_name = raw.ch_names[0]
         
-        channel_idx = raw.ch_names.index(channel_name)
-        data, times = raw[channel_idx, :]
-        
-        if time_range is not None:
-            start_time, end_time = time_range
-            start_idx = np.where(times >= start_time)[0][0]
-            end_idx = np.where(times <= end_time)[0][-1]
-            data = data[0, start_idx:end_idx]
-            times = times[start_idx:end_idx]
+        # Читаем с диска только выбранный канал и временное окно
+        y_data, times = raw.window(channel_name, time_range)
         
         fig = go.Figure()
-        # Исправляем проблему с типами данных
-        if time_range is not None:
-            # data уже обработан в блоке выше и является 1D массивом
-            y_data = data
-        else:
-            # data является 2D массивом, извлекаем первую строку
-            y_data = data[0]
-        
-        # Убеждаемся, что данные имеют правильный тип
-        y_data = np.asarray(y_data).flatten()
-        times = np.asarray(times).flatten()
         
         fig.add_trace(go.Scatter(x=times, y=y_data, mode='lines', name=channel_name))
         
@@ -444,63 +521,71 @@ def create_eeg_plot(raw, channel_name=None, time_range=None):
         fig.update_layout(title="Error: Could not create EEG plot")
         return fig
 
-def create_3d_surface_plot(data, isovalue=0.5, opacity=0.7):
+def render_live_surface(data, isovalue, opacity, step_size):
+    """Ближайшая готовая превью-сетка сразу, затем точная сетка, как только фоновое построение закончится"""
+    chart = st.empty()
+    session_id = st.session_state.session_id
+    exact_job = ISO_MESHES.exact(data, session_id, isovalue, step_size)
+    if not exact_job.done() or exact_job.cancelled():
+        preview = ISO_MESHES.nearest(data, isovalue)
+        if preview is not None:
+            preview_isovalue, verts, faces = preview
+            chart.plotly_chart(create_mesh_figure(verts, faces, opacity,
+                                                  f"Preview at Isovalue {preview_isovalue:.2f}"),
+                               use_container_width=True)
+        status = st.empty()
+        while not exact_job.done() or exact_job.cancelled():
+            # обновление элемента дает Streamlit прервать ожидание при новом движении ползунка
+            status.caption("⏳ Computing the exact isosurface...")
+            time.sleep(0.25)
+            # отмененная задача (сессия ее больше не держала) ставится в очередь заново
+            exact_job = ISO_MESHES.exact(data, session_id, isovalue, step_size)
+        status.empty()
     try:
-        data_norm = (data - data.min()) / (data.max() - data.min())
-        
-        verts, faces, _, _ = measure.marching_cubes(data_norm, level=isovalue)
-        
-        fig = go.Figure(data=[go.Mesh3d(
-            x=verts[:, 0],
-            y=verts[:, 1],
-            z=verts[:, 2],
-            i=faces[:, 0],
-            j=faces[:, 1],
-            k=faces[:, 2],
-            opacity=opacity,
-            colorscale='viridis',
-            name='3D Surface'
-        )])
-        
-        fig.update_layout(
-            scene=dict(
-                xaxis_title='X',
-                yaxis_title='Y',
-                zaxis_title='Z',
-                aspectmode='data'
-            ),
-            title="3D Surface Visualization",
-            showlegend=True
-        )
+        verts, faces = exact_job.result()
+    except Exception as e:
+        st.error(f"Error creating 3D surface: {e}")
+        return None
+    chart.plotly_chart(create_mesh_figure(verts, faces, opacity), use_container_width=True)
+
+def create_3d_surface_plot(data, isovalue=0.5, opacity=0.7, step_size=1):
+    try:
+        # кэшированная, упрощенная до бюджета треугольников сетка (float32/int32)
+        verts, faces = display_mesh(data, isovalue, step_size)
         
-        return fig
+        return create_mesh_figure(verts, faces, opacity)
     except Exception as e:
         st.error(f"Error creating 3D surface: {e}")
         return None
 
+def render_mesh_metrics(verts, faces, spacing):
+    """Площадь, объем и компоненты поверхности, построенной для 3D графика"""
+    metrics = mesh_metrics(verts, faces, spacing)
+    st.markdown(
+        f"**Surface area:** {metrics['surface_area']:,.1f} mm² · "
+        f"**Enclosed volume:** {metrics['volume']:,.1f} mm³ · "
+        f"**Components:** {metrics['n_components']}"
+    )
+    if metrics['components']:
+        with st.expander("Surface components"):
+            st.dataframe(pd.DataFrame(metrics['components']), use_container_width=True)
+
 def create_orthogonal_slices(data):
     fig = make_subplots(
         rows=2, cols=2,
         subplot_titles=('Axial', 'Coronal', 'Sagittal', '3D View'),
-        specs=[[{'type': 'heatmap'}, {'type': 'heatmap'}],
-               [{'type': 'heatmap'}, {'type': 'scatter3d'}]]
+        specs=[[{'type': 'xy'}, {'type': 'xy'}],
+               [{'type': 'xy'}, {'type': 'scatter3d'}]]
     )
     
-    # Axial slice
-    axial_slice = data[:, :, data.shape[2]//2]
-    fig.add_trace(go.Heatmap(z=axial_slice, colorscale='gray', showscale=False), row=1, col=1)
-    
-    # Coronal slice
-    coronal_slice = data[:, data.shape[1]//2, :]
-    fig.add_trace(go.Heatmap(z=coronal_slice, colorscale='gray', showscale=False), row=1, col=2)
-    
-    # Sagittal slice
-    sagittal_slice = data[data.shape[0]//2, :, :]
-    fig.add_trace(go.Heatmap(z=sagittal_slice, colorscale='gray', showscale=False), row=2, col=1)
+    # Axial, coronal and sagittal slices, rendered on the server
+    for axis, (row, col) in zip((2, 1, 0), ((1, 1), (1, 2), (2, 1))):
+        fig.add_trace(slice_image_trace(data, axis, data.shape[axis]//2, origin='lower'), row=row, col=col)
     
     # 3D scatter (simplified)
-    x, y, z = np.where(data > np.percentile(data, 95))
-    fig.add_trace(go.Scatter3d(x=x[::100], y=y[::100], z=z[::100], 
+    threshold = summarize_volume(data).percentile(95)
+    x, y, z, _ = sample_points(data, threshold)
+    fig.add_trace(go.Scatter3d(x=x, y=y, z=z, 
                               mode='markers', marker=dict(size=2)), row=2, col=2)
     
     fig.update_layout(height=800, title_text="Orthogonal Views")
@@ -508,15 +593,19 @@ def create_orthogonal_slices(data):
 
 def analyze_volume_statistics(data):
     """Анализирует статистики объемных данных"""
+    summary = summarize_volume(data)
     stats = {
-        'Shape': data.shape,
-        'Data Type': data.dtype,
-        'Min Value': float(data.min()),
-        'Max Value': float(data.max()),
-        'Mean Value': float(data.mean()),
-        'Std Value': float(data.std()),
-        'Non-zero Voxels': int(np.count_nonzero(data)),
-        'Total Voxels': int(data.size),
+        'Shape': summary.shape,
+        'Data Type': summary.dtype,
+        'Min Value': summary.min,
+        'Max Value': summary.max,
+        'Mean Value': summary.mean,
+        'Std Value': summary.std,
+        'Non-zero Voxels': summary.nonzero,
+        'Total Voxels': summary.size,
         'Memory Usage (MB)': float(data.nbytes / (1024 * 1024))
     }
+    if summary.rank_error:
+        # перцентили больших объемов приближенные (quantile sketch)
+        stats['Percentile Rank Error (%)'] = summary.rank_error * 100
     return stats
@@ -0,0 +1,81 @@
+"""
+Threshold-indexed point clouds of volumes for Scatter3d views
+"""
+
+import numpy as np
+
+from memo import memoize
+from stats_engine import slab_bounds
+from volume_summary import summarize_volume
+
+POINT_CLOUD_BUDGET = 20_000
+INDEX_FLOOR_PERCENTILE = 90
+INDEX_MAX_VOXELS = 4_000_000
+
+
+@memoize
+def intensity_index(data, floor_percentile=INDEX_FLOOR_PERCENTILE, max_voxels=INDEX_MAX_VOXELS, seed=0):
+    """(values, flat indices, floor, complete) of the voxels brighter than a percentile floor, sorted by value.
+
+    Built once per volume slab by slab; any threshold at or above the floor
+    (the views query the 95th percentile) is then a binary search and a
+    slice instead of a scan of the volume. The index holds at most
+    ``max_voxels`` entries, so it stays small next to the memo budget even
+    for chunked volumes: when more voxels pass the floor, a uniform random
+    subset is kept and ``complete`` is False.
+    """
+    summary = summarize_volume(data)
+    floor = summary.percentile(floor_percentile)
+    expected = max(1.0, summary.size * (1 - floor_percentile / 100))
+    keep_fraction = min(1.0, max_voxels / expected)
+    rng = np.random.default_rng(seed)
+    index_dtype = np.int32 if data.size < 2 ** 31 else np.int64
+    values, indices = [], []
+    for start, stop in slab_bounds(data):
+        slab = np.asarray(data[..., start:stop])
+        i, j, k = np.nonzero(slab > floor)
+        if keep_fraction < 1.0:
+            kept = rng.random(len(i)) < keep_fraction
+            i, j, k = i[kept], j[kept], k[kept]
+        values.append(slab[i, j, k])
+        indices.append(np.ravel_multi_index((i, j, k + start), data.shape).astype(index_dtype))
+    values = np.concatenate(values)
+    indices = np.concatenate(indices)
+    complete = keep_fraction == 1.0
+    if len(values) > max_voxels:
+        # перцентиль сжатого объема приближенный: урезаем до лимита
+        kept = np.sort(rng.choice(len(values), max_voxels, replace=False))
+        values, indices, complete = values[kept], indices[kept], False
+    order = np.argsort(values, kind='stable')
+    return values[order], indices[order], floor, complete
+
+
+def threshold_voxels(data, threshold):
+    """(values, flat indices) of the voxels above threshold in the index, in increasing value order"""
+    values, indices, floor, _ = intensity_index(data)
+    if threshold < floor:
+        raise ValueError(f"Threshold {threshold:g} is below the index floor {floor:g}")
+    start = np.searchsorted(values, threshold, side='right')
+    return values[start:], indices[start:]
+
+
+def stratified_sample(count, max_points, seed=0):
+    """Positions of up to max_points items out of count: one random pick from each of max_points equal strata"""
+    if count <= max_points:
+        return np.arange(count)
+    edges = np.floor(np.linspace(0, count, max_points + 1)).astype(np.int64)
+    rng = np.random.default_rng(seed)
+    return edges[:-1] + (rng.random(max_points) * np.diff(edges)).astype(np.int64)
+
+
+def sample_points(data, threshold, max_points=POINT_CLOUD_BUDGET, seed=0):
+    """(x, y, z, values) of at most max_points voxels above threshold.
+
+    The strata run along the intensity order, so the sample keeps the
+    intensity distribution of the selection without the aliasing of a
+    fixed stride; the fixed seed keeps the cloud stable across reruns.
+    """
+    values, indices = threshold_voxels(data, threshold)
+    picks = stratified_sample(len(values), max_points, seed)
+    x, y, z = np.unravel_index(indices[picks], data.shape)
+    return x, y, z, values[picks]
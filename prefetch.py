@@ -0,0 +1,102 @@
+"""
+Background prefetch of NIfTI volumes for the Advanced Medical Visualization Tool
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from volume_io import LazyVolume, open_volume
+
+PREFETCH_WORKERS = 2
+PREFETCH_AHEAD = 2
+PREFETCH_READY = 4
+PREFETCH_LOAD_BYTES = 512 * 1024 * 1024
+
+
+def prefetch_volume(file_path, report):
+    """Open a volume and, if it fits the budget, read it through once.
+
+    The read warms the page cache (and the decompressed sidecar of .nii.gz
+    files) without keeping an array: retained jobs hold unloaded handles,
+    so browsing the picker pins no memory outside the sessions' budgets.
+    """
+    report(0.0)
+    volume, header, affine = open_volume(file_path)
+    if isinstance(volume, LazyVolume) and not volume.is_loaded and volume.nbytes <= PREFETCH_LOAD_BYTES:
+        for start, slab in volume.iter_slabs():
+            report((start + slab.shape[-1]) / volume.shape[-1])
+    report(1.0)
+    return volume, header, affine
+
+
+class VolumePrefetcher:
+    """Thread pool that opens and decodes volumes before they are requested.
+
+    Jobs are keyed by file path and shared by every session; at most
+    ``max_ready`` of them are retained, least recently requested first out.
+    Progress of each job is published as a fraction in ``[0, 1]``.
+    """
+
+    def __init__(self, loader=prefetch_volume, max_workers=PREFETCH_WORKERS, max_ready=PREFETCH_READY):
+        self.loader = loader
+        self.max_ready = max_ready
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._jobs = OrderedDict()
+        self._progress = {}
+        self._lock = threading.Lock()
+
+    def request(self, file_path):
+        """Future for file_path, submitting a job if none is running or retained"""
+        with self._lock:
+            if file_path in self._jobs:
+                self._jobs.move_to_end(file_path)
+                return self._jobs[file_path]
+
+            self._progress[file_path] = 0.0
+
+            def report(fraction):
+                if file_path in self._jobs:
+                    self._progress[file_path] = fraction
+
+            future = self._executor.submit(self.loader, file_path, report)
+            self._jobs[file_path] = future
+
+            while len(self._jobs) > self.max_ready:
+                old_path, old_future = self._jobs.popitem(last=False)
+                old_future.cancel()
+                self._progress.pop(old_path, None)
+            return future
+
+    def prefetch(self, file_paths):
+        """Queue jobs for file_paths in order; the first one is read first and retained longest"""
+        file_paths = list(file_paths)[:self.max_ready]
+        for file_path in file_paths:
+            self.request(file_path)
+        if file_paths:
+            self.request(file_paths[0])
+
+    def progress(self, file_path):
+        return self._progress.get(file_path, 0.0)
+
+    def take(self, file_path):
+        """Block until file_path is ready and return the loader's result.
+
+        Each caller gets its own LazyVolume handle; loaded arrays are shared
+        through SHARED_ARRAYS, so one session releasing its volume does not
+        affect the others.
+        """
+        future = self.request(file_path)
+        try:
+            volume, header, affine = future.result()
+        except Exception:
+            with self._lock:
+                if self._jobs.get(file_path) is future:
+                    del self._jobs[file_path]
+            raise
+        if isinstance(volume, LazyVolume):
+            volume = volume.handle()
+        return volume, header, affine
+
+
+PREFETCHER = VolumePrefetcher()
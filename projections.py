@@ -0,0 +1,89 @@
+"""
+Max/min/mean/std intensity projections for the Advanced Medical Visualization Tool
+"""
+
+import numpy as np
+
+from memo import memoize
+
+PROJECTION_KINDS = ('max', 'min', 'mean', 'std')
+PROJECTION_LABELS = {
+    'max': 'Maximum Intensity Projection',
+    'min': 'Minimum Intensity Projection',
+    'mean': 'Mean Intensity Projection',
+    'std': 'Standard Deviation Projection',
+}
+PROJECTION_SLAB_BYTES = 32 * 1024 * 1024
+
+
+def normalize_box(box, shape):
+    """Box as three (start, stop) pairs clipped to shape; None (or a None axis) spans the whole axis"""
+    if box is None:
+        box = (None,) * len(shape)
+    ranges = []
+    for bounds, n in zip(box, shape):
+        start, stop = (0, n) if bounds is None else bounds
+        start, stop = max(0, int(start)), min(n, int(stop))
+        if stop <= start:
+            raise ValueError(f"Empty projection range {bounds} for axis of length {n}")
+        ranges.append((start, stop))
+    return tuple(ranges)
+
+
+@memoize
+def compute_projections(data, box=None):
+    """Max, min, mean and std projections along all three axes of a 3D volume (or of a box in it).
+
+    The box is read once, slab by slab along the last axis: each slab
+    yields its complete projections along the first two axes and updates
+    running max/min/sum/sum-of-squares planes for the last one. Pass a box
+    restricted along one axis to get thick-slab projections. Returns
+    ``{axis: {kind: 2D array}}``; max/min keep the volume dtype, mean/std
+    are float32.
+    """
+    (x0, x1), (y0, y1), (z0, z1) = normalize_box(box, data.shape)
+    nx, ny, nz = x1 - x0, y1 - y0, z1 - z0
+    dtype = data.dtype
+
+    along = {
+        0: {'max': np.empty((ny, nz), dtype), 'min': np.empty((ny, nz), dtype),
+            'mean': np.empty((ny, nz), np.float32), 'std': np.empty((ny, nz), np.float32)},
+        1: {'max': np.empty((nx, nz), dtype), 'min': np.empty((nx, nz), dtype),
+            'mean': np.empty((nx, nz), np.float32), 'std': np.empty((nx, nz), np.float32)},
+    }
+    z_max = np.full((nx, ny), -np.inf)
+    z_min = np.full((nx, ny), np.inf)
+    z_sum = np.zeros((nx, ny))
+    z_sum_sq = np.zeros((nx, ny))
+
+    plane_bytes = nx * ny * 8
+    step = max(1, PROJECTION_SLAB_BYTES // plane_bytes)
+    block_depth = getattr(data, 'block_shape', (1,))[-1]
+    step = max(block_depth, step // block_depth * block_depth)
+    for start in range(z0, z1, step):
+        stop = min(start + step, z1)
+        slab = np.asarray(data[x0:x1, y0:y1, start:stop])
+        weights = slab.astype(np.float64)
+        squares = np.square(weights)
+        cols = slice(start - z0, stop - z0)
+
+        for axis, size in ((0, nx), (1, ny)):
+            mean = weights.sum(axis=axis) / size
+            along[axis]['max'][:, cols] = slab.max(axis=axis)
+            along[axis]['min'][:, cols] = slab.min(axis=axis)
+            along[axis]['mean'][:, cols] = mean
+            along[axis]['std'][:, cols] = np.sqrt(np.maximum(squares.sum(axis=axis) / size - mean ** 2, 0.0))
+
+        np.maximum(z_max, weights.max(axis=2), out=z_max)
+        np.minimum(z_min, weights.min(axis=2), out=z_min)
+        z_sum += weights.sum(axis=2)
+        z_sum_sq += squares.sum(axis=2)
+
+    z_mean = z_sum / nz
+    along[2] = {
+        'max': z_max.astype(dtype),
+        'min': z_min.astype(dtype),
+        'mean': z_mean.astype(np.float32),
+        'std': np.sqrt(np.maximum(z_sum_sq / nz - z_mean ** 2, 0.0)).astype(np.float32),
+    }
+    return along
@@ -0,0 +1,173 @@
+"""
+Multi-resolution slice pyramids persisted next to loaded volumes
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from chunked_store import evict_directories
+
+PYRAMID_DIR = './temp_pyramids'
+PYRAMID_STORE_BYTES = 4 * 1024 * 1024 * 1024
+PYRAMID_FACTORS = (2, 4, 8)
+PYRAMID_SLAB_BYTES = 64 * 1024 * 1024
+SLICE_VIEWPORT_PX = 512
+META_FILE_NAME = 'pyramid.json'
+
+
+def block_reduce(block, factor, reducer=np.mean):
+    """Reduce factor×factor×… blocks of an array (edge voxels replicated to a multiple of factor)"""
+    pad = [(0, -n % factor) for n in block.shape]
+    if any(p for _, p in pad):
+        block = np.pad(block, pad, mode='edge')
+    shape = []
+    for n in block.shape:
+        shape.extend((n // factor, factor))
+    axes = tuple(range(1, 2 * block.ndim, 2))
+    if reducer is np.mean:
+        return block.reshape(shape).mean(axis=axes, dtype=np.float64)
+    return reducer(block.reshape(shape), axis=axes)
+
+
+def downsample2(block):
+    """2× area-average in every axis; the box filter is the anti-aliasing"""
+    return block_reduce(block, 2)
+
+
+def downsample_into(source, target_path, dtype, max_bytes=PYRAMID_SLAB_BYTES):
+    """Write the 2× reduction of source to a .npy file, reading it slab by slab along the last axis"""
+    shape = tuple(-(-n // 2) for n in source.shape)
+    target = np.lib.format.open_memmap(target_path, mode='w+', dtype=dtype, shape=shape)
+    plane_bytes = max(1, int(np.prod(source.shape[:-1])) * 8)
+    step = max(2, max_bytes // plane_bytes // 2 * 2)
+    for start in range(0, source.shape[-1], step):
+        slab = np.asarray(source[..., start:start + step])
+        target[..., start // 2:start // 2 + -(-slab.shape[-1] // 2)] = downsample2(slab)
+    target.flush()
+    del target
+
+
+def pyramid_path(volume):
+    return os.path.join(PYRAMID_DIR, uuid.uuid5(uuid.NAMESPACE_URL, volume.content_key).hex)
+
+
+class PyramidLevel:
+    """One downsampled level, indexable like the volume it was built from"""
+
+    def __init__(self, array, factor, content_key):
+        self.array = array
+        self.factor = factor
+        self.content_key = f'{content_key}:pyramid{factor}'
+        self.shape = array.shape
+        self.ndim = array.ndim
+        self.dtype = array.dtype
+
+    def slice(self, axis, index):
+        return np.take(self.array, index, axis=axis)
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+
+class VolumePyramid:
+    """2×, 4× and 8× reductions of a volume stored as memory-mapped .npy files"""
+
+    def __init__(self, path, content_key):
+        with open(os.path.join(path, META_FILE_NAME)) as f:
+            meta = json.load(f)
+        self.path = path
+        self.levels = {
+            factor: PyramidLevel(np.load(os.path.join(path, name), mmap_mode='r'), factor, content_key)
+            for factor, name in zip(meta['factors'], meta['files'])
+        }
+
+    @classmethod
+    def build(cls, volume, path, factors=PYRAMID_FACTORS):
+        """Build (once) and open the pyramid of volume at path"""
+        if not os.path.exists(os.path.join(path, META_FILE_NAME)):
+            staging = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            dtype = volume.dtype if np.issubdtype(volume.dtype, np.floating) else np.float32
+            source, files = volume, []
+            for factor in factors:
+                name = f'level{factor}.npy'
+                downsample_into(source, os.path.join(staging, name), dtype)
+                files.append(name)
+                source = np.load(os.path.join(staging, name), mmap_mode='r')
+            del source
+            with open(os.path.join(staging, META_FILE_NAME), 'w') as f:
+                json.dump({'shape': list(volume.shape), 'factors': list(factors), 'files': files}, f)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                shutil.rmtree(staging, ignore_errors=True)
+                if not os.path.isdir(path):
+                    raise
+            evict_directories(os.path.dirname(path), PYRAMID_STORE_BYTES, keep=[path])
+        else:
+            os.utime(path)
+        return cls(path, volume.content_key)
+
+    def level_for(self, plane_shape, viewport=SLICE_VIEWPORT_PX):
+        """Coarsest level whose planes still cover the viewport, or None for full resolution"""
+        fitting = [f for f in self.levels if max(plane_shape) / f >= viewport]
+        return self.levels[max(fitting)] if fitting else None
+
+
+class PyramidBuilder:
+    """Builds pyramids in a background thread and hands out the ones that are ready"""
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pyramid')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def request(self, volume):
+        """Pyramid of volume if already built; otherwise start building it and return None"""
+        # in-memory arrays have no file identity to name the sidecar after
+        if getattr(volume, 'content_key', None) is None or volume.ndim != 3 or max(volume.shape) <= SLICE_VIEWPORT_PX:
+            return None
+        path = pyramid_path(volume)
+        with self._lock:
+            job = self._jobs.get(path)
+            if job is not None and job.done() and not os.path.isdir(path):
+                # пирамида вытеснена из хранилища: строим заново
+                job = None
+            if job is None:
+                # build() only opens (and touches) a pyramid that is already on disk
+                job = self._executor.submit(VolumePyramid.build, volume, path)
+                self._jobs[path] = job
+        if not job.done() or job.exception() is not None:
+            return None
+        return job.result()
+
+    def shutdown(self):
+        """Drop queued builds; a build in progress leaves only its staging directory behind"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+PYRAMIDS = PyramidBuilder()
+
+
+def slice_level(volume, axis, index, full_resolution=False, viewport=SLICE_VIEWPORT_PX):
+    """(data, index, factor) to render slice ``index`` along ``axis`` from.
+
+    Uses the coarsest ready pyramid level that still fills the viewport and
+    falls back to the volume itself (factor 1) while the pyramid is being
+    built or when ``full_resolution`` is asked for.
+    """
+    pyramid = PYRAMIDS.request(volume)
+    if full_resolution or pyramid is None:
+        return volume, index, 1
+    plane_shape = [n for a, n in enumerate(volume.shape) if a != axis]
+    level = pyramid.level_for(plane_shape, viewport)
+    if level is None:
+        return volume, index, 1
+    return level, min(index // level.factor, level.shape[axis] - 1), level.factor
@@ -0,0 +1,123 @@
+"""
+Mergeable streaming quantile sketch (KLL) for out-of-core volume statistics
+"""
+
+import math
+
+import numpy as np
+
+SKETCH_K = 1024
+SKETCH_CONFIDENCE = 0.99
+
+
+class KLLSketch:
+    """KLL quantile sketch fed with arrays of values and mergeable with other sketches.
+
+    Items on level ``h`` stand for ``2**h`` input values. When a level
+    exceeds its capacity it is sorted and every other item (from a random
+    offset) is promoted to the next level. Each such compaction moves any
+    rank estimate by at most the level weight, with zero mean, so the total
+    rank error is bounded with high probability (Hoeffding) by
+    :meth:`rank_error`. Memory stays O(k log(n / k)) however many values are
+    fed. Sketches pickle, so workers can build partial sketches and the
+    parent merges them.
+    """
+
+    def __init__(self, k=SKETCH_K, c=2 / 3, seed=None):
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [np.empty(0)]
+        self.variance = 0.0
+        self._rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * self.c ** depth)))
+
+    def update(self, values):
+        """Add an array (of any shape) of values"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.n += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Fold another sketch into this one"""
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.variance += other.variance
+        self._compress()
+        return self
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays on this level so the compacted part has even length
+                keep = items[len(items) - len(items) % 2:]
+                offset = int(self._rng.integers(2))
+                promoted = items[offset:len(items) - len(keep):2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.variance += float(2 ** level) ** 2
+            level += 1
+
+    def items(self):
+        """Sorted retained items and their weights"""
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level, dtype=np.int64)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    def __len__(self):
+        return sum(len(items) for items in self.levels)
+
+    def quantiles(self, qs):
+        """Approximate quantiles for fractions qs in [0, 1]; 0 and 1 return the exact min and max"""
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        values, weights = self.items()
+        cumulative = np.cumsum(weights)
+        idx = np.searchsorted(cumulative, qs * cumulative[-1], side='left')
+        result = values[np.clip(idx, 0, len(values) - 1)]
+        result[qs <= 0] = self.min
+        result[qs >= 1] = self.max
+        return result
+
+    def percentiles(self, ps):
+        return self.quantiles(np.asarray(ps, dtype=np.float64) / 100)
+
+    def rank(self, value):
+        """Approximate fraction of values <= value"""
+        if self.n == 0:
+            return float('nan')
+        values, weights = self.items()
+        return float(weights[values <= value].sum()) / weights.sum()
+
+    def rank_error(self, confidence=SKETCH_CONFIDENCE):
+        """Bound on the normalized rank error of any single query, holding with the given confidence"""
+        if self.n == 0:
+            return 0.0
+        return math.sqrt(2 * self.variance * math.log(2 / (1 - confidence))) / self.n
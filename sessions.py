@@ -0,0 +1,69 @@
+"""
+Release of per-session resources when Streamlit drops a session
+"""
+
+import collections
+import threading
+import weakref
+
+from memory_governor import GOVERNOR
+from upload_cache import UPLOAD_CACHE
+
+REAP_INTERVAL_SECONDS = 5.0
+
+
+class SessionToken:
+    """Kept in st.session_state; collected along with the state when Streamlit drops the session"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+
+
+class SessionReaper:
+    """Calls ``release_session(session_id)`` on every registry once a session's token is collected.
+
+    Process-wide registries (the memory governor, the upload cache) outlive
+    ``st.session_state``, so without this a closed tab would keep its
+    arrays, spill files and upload references until the server exits. The
+    finalizer only queues the id: it can run inside a garbage collection on
+    any thread, possibly one holding a registry lock, so the releases are
+    done by a background thread.
+    """
+
+    def __init__(self, registries=(), interval=REAP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._registries = list(registries)
+        self._ended = collections.deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def register(self, registry):
+        self._registries.append(registry)
+
+    def token(self, session_id):
+        """New token for a session; keep it in the session's state"""
+        token = SessionToken(session_id)
+        weakref.finalize(token, self._ended.append, session_id).atexit = False
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='session-reaper', daemon=True)
+                self._thread.start()
+        return token
+
+    def reap(self):
+        """Release the sessions whose tokens have been collected"""
+        while self._ended:
+            session_id = self._ended.popleft()
+            for registry in self._registries:
+                registry.release_session(session_id)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.reap()
+
+    def shutdown(self):
+        self._stop.set()
+
+
+SESSIONS = SessionReaper((GOVERNOR, UPLOAD_CACHE))
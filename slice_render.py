@@ -0,0 +1,103 @@
+"""
+Server-side rendering of volume slices to compressed images
+"""
+
+import base64
+import functools
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib import colormaps
+from PIL import Image
+
+from memo import dataset_key
+
+SLICE_CACHE_BYTES = 64 * 1024 * 1024
+SLICE_IMAGE_FORMAT = 'PNG'
+SLICE_COLORMAPS = ('gray', 'bone', 'viridis', 'hot', 'jet')
+
+
+@functools.lru_cache(maxsize=32)
+def colormap_lut(name):
+    """256-entry RGB lookup table of a matplotlib colormap"""
+    return (colormaps[name](np.linspace(0.0, 1.0, 256))[:, :3] * 255).round().astype(np.uint8)
+
+
+def default_window(summary):
+    """(level, width) covering the 1st to 99th percentile of a VolumeSummary"""
+    low, high = summary.percentile(1), summary.percentile(99)
+    if high <= low:
+        low, high = summary.min, summary.max
+    return (low + high) / 2, max(high - low, 1e-6)
+
+
+def apply_window(plane, level, width):
+    """Map level ± width/2 onto 0..255"""
+    scaled = (np.asarray(plane, dtype=np.float32) - (level - width / 2)) * (255.0 / width)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def render_plane(plane, window, colormap='gray', fmt=SLICE_IMAGE_FORMAT, origin='upper'):
+    """Encode a 2D array as an image after window/level and a colormap lookup.
+
+    ``origin='lower'`` puts the first row at the bottom, as go.Heatmap does.
+    """
+    pixels = apply_window(plane, *window)
+    if origin == 'lower':
+        pixels = pixels[::-1]
+    if colormap != 'gray':
+        pixels = colormap_lut(colormap)[pixels]
+    buffer = io.BytesIO()
+    if fmt == 'WEBP':
+        Image.fromarray(pixels).save(buffer, format='WEBP', lossless=True)
+    else:
+        Image.fromarray(pixels).save(buffer, format=fmt, compress_level=3)
+    return buffer.getvalue()
+
+
+def read_plane(data, axis, index):
+    if hasattr(data, 'slice'):
+        return data.slice(axis, index)
+    return np.take(np.asarray(data), index, axis=axis)
+
+
+def image_source(image, fmt=SLICE_IMAGE_FORMAT):
+    """data: URI for an encoded image, usable as a go.Image source"""
+    return f"data:image/{fmt.lower()};base64,{base64.b64encode(image).decode('ascii')}"
+
+
+class SliceRenderer:
+    """Encoded slice images keyed by (volume, axis, index, window, colormap, format, origin).
+
+    Images are a few KB, so a byte-bounded LRU keeps thousands of frames
+    and scrubbing back over visited slices does not touch the volume.
+    """
+
+    def __init__(self, max_bytes=SLICE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, data, axis, index, window, colormap='gray', fmt=SLICE_IMAGE_FORMAT, origin='upper'):
+        key = (dataset_key(data), axis, int(index), tuple(float(w) for w in window), colormap, fmt, origin)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+
+        image = render_plane(read_plane(data, axis, index), window, colormap, fmt, origin)
+
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = image
+                self.used_bytes += len(image)
+            while self.used_bytes > self.max_bytes and len(self._images) > 1:
+                _, old = self._images.popitem(last=False)
+                self.used_bytes -= len(old)
+        return image
+
+
+SLICE_RENDERER = SliceRenderer()
@@ -0,0 +1,115 @@
+"""
+Parallel slab-wise volume statistics for the Advanced Medical Visualization Tool
+"""
+
+import itertools
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from memo import memoize
+
+STATS_WORKERS = os.cpu_count() or 1
+STATS_SLAB_BYTES = 32 * 1024 * 1024
+SLABS_PER_WORKER = 4
+
+
+def slab_bounds(data, workers=STATS_WORKERS, max_bytes=STATS_SLAB_BYTES):
+    """[start, stop) ranges along the last axis, small enough to bound memory and to keep every worker busy"""
+    depth = data.shape[-1]
+    plane_bytes = max(1, data.size // max(1, depth) * data.dtype.itemsize)
+    step = max(1, min(max_bytes // plane_bytes, math.ceil(depth / (workers * SLABS_PER_WORKER))))
+    block_depth = getattr(data, 'block_shape', (1,))[-1]
+    step = max(block_depth, step // block_depth * block_depth)
+    return [(start, min(start + step, depth)) for start in range(0, depth, step)]
+
+
+def slab_partial(slab, start):
+    """Moments of one slab covering planes start:start + n of the last axis"""
+    weights = slab.astype(np.float64, copy=False)
+    ndim = weights.ndim
+    coords = [np.arange(n, dtype=np.float64) for n in weights.shape]
+    coords[-1] += start
+    profiles = [weights.sum(axis=tuple(a for a in range(ndim) if a != i)) for i in range(ndim)]
+
+    first = np.array([profiles[i] @ coords[i] for i in range(ndim)])
+    second = np.diag([profiles[i] @ np.square(coords[i]) for i in range(ndim)])
+    for i, j in itertools.combinations(range(ndim), 2):
+        plane = weights.sum(axis=tuple(a for a in range(ndim) if a not in (i, j)))
+        second[i, j] = second[j, i] = coords[i] @ plane @ coords[j]
+
+    flat = weights.ravel()
+    return {
+        'start': start,
+        'min': float(slab.min()),
+        'max': float(slab.max()),
+        'sum': float(profiles[0].sum()),
+        'sum_sq': float(np.dot(flat, flat)),
+        'nonzero': int(np.count_nonzero(slab)),
+        'count': int(slab.size),
+        'first': first,
+        'second': second,
+        'profiles': profiles,
+    }
+
+
+def reduce_partials(shape, partials):
+    """Combine slab partials into whole-volume statistics"""
+    count = sum(p['count'] for p in partials)
+    total = sum(p['sum'] for p in partials)
+    mean = total / count
+    first = sum(p['first'] for p in partials)
+    second = sum(p['second'] for p in partials)
+
+    profiles = [np.zeros(n) for n in shape]
+    for p in partials:
+        for axis, profile in enumerate(p['profiles'][:-1]):
+            profiles[axis] += profile
+        last = p['profiles'][-1]
+        profiles[-1][p['start']:p['start'] + len(last)] += last
+
+    if total:
+        center = first / total
+        central = second / total - np.outer(center, center)
+    else:
+        center = np.full(len(shape), np.nan)
+        central = np.full((len(shape), len(shape)), np.nan)
+
+    return {
+        'count': count,
+        'min': min(p['min'] for p in partials),
+        'max': max(p['max'] for p in partials),
+        'sum': total,
+        'mean': mean,
+        'std': math.sqrt(max(sum(p['sum_sq'] for p in partials) / count - mean ** 2, 0.0)),
+        'nonzero': sum(p['nonzero'] for p in partials),
+        'center_of_mass': tuple(float(c) for c in center),
+        'second_moments': central,
+        'axis_means': tuple(profile / (count / n) for profile, n in zip(profiles, shape)),
+    }
+
+
+@memoize
+def volume_stats(data, workers=STATS_WORKERS):
+    """Min, max, mean, std, nonzero count, center of mass, central second moments and axis mean profiles.
+
+    Works on arrays, LazyVolumes and ChunkedVolumes in one pass: the volume
+    is cut into slabs along its last axis (aligned to blocks for chunked
+    volumes), each slab is reduced in a thread pool and the partial sums are
+    combined. NumPy releases the GIL in the reductions, so the pass scales
+    with the number of cores.
+    """
+    bounds = slab_bounds(data, workers)
+
+    def reduce_slab(bound):
+        start, stop = bound
+        return slab_partial(np.asarray(data[..., start:stop]), start)
+
+    if workers <= 1 or len(bounds) == 1:
+        partials = [reduce_slab(bound) for bound in bounds]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stats') as pool:
+            partials = list(pool.map(reduce_slab, bounds))
+    return reduce_partials(data.shape, partials)
@@ -0,0 +1,135 @@
+"""
+Content-addressed cache of uploaded studies shared by all sessions
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+REFS_DIR = '.refs'
+EDF_FILE_NAME = 'recording.edf'
+
+
+def content_hash(uploaded_file):
+    """SHA-256 of an uploaded file's contents, read in chunks from its buffer"""
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(HASH_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()[:32]
+
+
+def write_upload(uploaded_file, target):
+    """Stream an uploaded file's buffer to target"""
+    uploaded_file.seek(0)
+    with open(target, 'wb') as dst:
+        shutil.copyfileobj(uploaded_file, dst, HASH_CHUNK_BYTES)
+    uploaded_file.seek(0)
+
+
+class UploadCache:
+    """Extracted uploads keyed by content hash, reference counted per session.
+
+    Each entry is a ``temp_<kind>_<hash>`` directory under ``root``. A
+    session holding an entry leaves a ``.refs/<pid>-<session_id>`` marker in
+    it, so servers sharing the working directory see each other's
+    references; an entry is deleted only when its last marker is removed.
+    Parsed objects built from an entry (e.g. an MNE Raw) are kept in
+    process and shared by every session that references the entry.
+    """
+
+    def __init__(self, root='.'):
+        self.root = root
+        self._lock = threading.RLock()
+        self._held = {}
+        self._parsed = {}
+        self._populating = {}
+
+    def entry_path(self, kind, key):
+        return os.path.join(self.root, f'temp_{kind}_{key}')
+
+    def _marker(self, path, session_id):
+        return os.path.join(path, REFS_DIR, f'{os.getpid()}-{session_id}')
+
+    def acquire(self, kind, key, session_id, populate):
+        """Reference the entry for (kind, key), building it with populate(path) on a miss.
+
+        Extraction runs under a per-entry lock, so a large upload does not
+        hold up sessions acquiring or releasing other entries.
+        """
+        path = self.entry_path(kind, key)
+        while True:
+            with self._lock:
+                if os.path.isdir(path):
+                    os.makedirs(os.path.join(path, REFS_DIR), exist_ok=True)
+                    open(self._marker(path, session_id), 'a').close()
+                    self._held.setdefault(session_id, set()).add(path)
+                    return path
+                entry_lock = self._populating.setdefault(path, threading.Lock())
+
+            with entry_lock:
+                try:
+                    if not os.path.isdir(path):
+                        self._populate(path, populate)
+                finally:
+                    with self._lock:
+                        self._populating.pop(path, None)
+
+    def _populate(self, path, populate):
+        staging = f'{path}.partial-{os.getpid()}'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            populate(staging)
+            os.rename(staging, path)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+
+    def parsed(self, path, loader):
+        """Object parsed from an entry, built once with loader() and shared across sessions"""
+        with self._lock:
+            if path not in self._parsed:
+                value = loader()
+                if value is None:
+                    return None
+                self._parsed[path] = value
+            return self._parsed[path]
+
+    def references(self, path):
+        refs_dir = os.path.join(path, REFS_DIR)
+        if not os.path.isdir(refs_dir):
+            return 0
+        return len(os.listdir(refs_dir))
+
+    def release(self, path, session_id):
+        """Drop a session's reference, deleting the entry if no session still uses it"""
+        with self._lock:
+            held = self._held.get(session_id, set())
+            held.discard(path)
+            marker = self._marker(path, session_id)
+            if os.path.exists(marker):
+                os.unlink(marker)
+            if os.path.isdir(path) and self.references(path) == 0:
+                self._parsed.pop(path, None)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def release_session(self, session_id):
+        """Drop every reference held by a session"""
+        with self._lock:
+            for path in list(self._held.get(session_id, ())):
+                self.release(path, session_id)
+            self._held.pop(session_id, None)
+
+    def shutdown(self):
+        """Release all sessions of this process; entries other processes still reference survive"""
+        with self._lock:
+            for session_id in list(self._held):
+                self.release_session(session_id)
+
+
+UPLOAD_CACHE = UploadCache()
@@ -9,49 +9,160 @@ import mne
 from scipy import ndimage, signal
 import tempfile
 import os
+from chunked_store import ChunkedVolume
+from memo import memoize
+from volume_summary import summarize_volume
+from stats_engine import volume_stats
+from slice_render import SLICE_RENDERER, default_window, image_source
+from mesh_metrics import surface_area
+from mesh_simplify import MESH_FACE_BUDGET, decimate_mesh
+from pyramid import block_reduce, slice_level
+from projections import PROJECTION_LABELS, compute_projections
+
+def as_float(data):
+    """Floating view of data for kernels that need it: integers become float32, floats are kept"""
+    data = np.asarray(data)
+    if np.issubdtype(data.dtype, np.floating):
+        return data
+    return data.astype(np.float32)
 
 def normalize_data(data, method='minmax'):
+    if isinstance(data, ChunkedVolume):
+        return normalize_chunked(data, method)
+
+    summary = summarize_volume(data)
+    data = as_float(data)
     if method == 'minmax':
-        return (data - data.min()) / (data.max() - data.min())
+        return (data - summary.min) / (summary.max - summary.min)
     elif method == 'zscore':
-        return (data - data.mean()) / data.std()
+        return (data - summary.mean) / summary.std
     elif method == 'robust':
-        q75, q25 = np.percentile(data, [75, 25])
-        iqr = q75 - q25
-        median = np.median(data)
-        return (data - median) / iqr
+        iqr = summary.percentile(75) - summary.percentile(25)
+        return (data - summary.median) / iqr
     else:
         return data
 
 def apply_filters(data, filter_type='gaussian', **kwargs):
 
+    if isinstance(data, ChunkedVolume):
+        return data.map_blocks(lambda block: apply_filters(block, filter_type, **kwargs),
+                               halo=filter_halo(filter_type, **kwargs))
+
     if filter_type == 'gaussian':
         sigma = kwargs.get('sigma', 1.0)
-        return filters.gaussian(data, sigma=sigma)
+        return filters.gaussian(as_float(data), sigma=sigma)
     elif filter_type == 'median':
         size = kwargs.get('size', 3)
         return filters.median(data, size=size)
     elif filter_type == 'bilateral':
         sigma_color = kwargs.get('sigma_color', 0.05)
         sigma_spatial = kwargs.get('sigma_spatial', 1.0)
-        return filters.bilateral(data, sigma_color=sigma_color, sigma_spatial=sigma_spatial)
+        return filters.bilateral(as_float(data), sigma_color=sigma_color, sigma_spatial=sigma_spatial)
+    else:
+        return data
+
+def apply_morphology(data, operation='opening', size=3):
+    """Binary erosion, dilation, opening or closing with a size³ cube"""
+    if isinstance(data, ChunkedVolume):
+        # запас в size вокселей покрывает оба прохода opening/closing
+        return data.map_blocks(lambda block: apply_morphology(block, operation, size), halo=size, dtype=bool)
+
+    structure = np.ones((size,) * 3)
+    if operation == 'erosion':
+        return ndimage.binary_erosion(data, structure=structure)
+    elif operation == 'dilation':
+        return ndimage.binary_dilation(data, structure=structure)
+    elif operation == 'opening':
+        return ndimage.binary_opening(data, structure=structure)
+    elif operation == 'closing':
+        return ndimage.binary_closing(data, structure=structure)
     else:
         return data
 
-def create_volume_rendering(data, opacity_function='linear', colormap='viridis'):
+VOLUME_RENDER_VOXELS = 64 ** 3
+SURFACE_MESH_VOXELS = 256 ** 3
+VOLUME_RENDER_SLAB_BYTES = 64 * 1024 * 1024
+
+def nonzero_box(data):
+    """(start, stop) per axis of the bounding box of nonzero voxels, from the cached max/min projections"""
+    projections = compute_projections(data)
+    box = []
+    for axis in range(3):
+        # проекция вдоль другой оси содержит данную ось
+        other = (axis + 1) % 3
+        plane = (projections[other]['max'] != 0) | (projections[other]['min'] != 0)
+        position = [a for a in range(3) if a != other].index(axis)
+        occupied = np.flatnonzero(plane.any(axis=1 - position))
+        if occupied.size == 0:
+            return tuple((0, n) for n in data.shape)
+        box.append((int(occupied[0]), int(occupied[-1]) + 1))
+    return tuple(box)
+
+def budget_factor(shape, max_voxels):
+    """Smallest integer block size that brings a grid of the given shape within max_voxels"""
+    factor = max(1, int(np.ceil((np.prod(shape) / max_voxels) ** (1 / 3))))
+    while np.prod([-(-n // factor) for n in shape]) > max_voxels:
+        factor += 1
+    return factor
 
-    data_norm = normalize_data(data)
+@memoize
+def volume_render_grid(data, max_voxels=VOLUME_RENDER_VOXELS, reduction='mean'):
+    """Cropped, block-reduced float32 grid of a volume within a voxel budget.
+
+    Returns ``(grid, box, factor)``: the grid covers ``box`` (the bounding
+    box of nonzero data) and each of its voxels is the mean or max of a
+    factor³ block, read slab by slab so chunked volumes stay out of core.
+    """
+    box = nonzero_box(data)
+    factor = budget_factor([stop - start for start, stop in box], max_voxels)
+    reducer = np.mean if reduction == 'mean' else np.max
+    (x0, x1), (y0, y1), (z0, z1) = box
+    grid = np.empty([-(-(stop - start) // factor) for start, stop in box], dtype=np.float32)
+    plane_bytes = max(1, (x1 - x0) * (y1 - y0) * 8)
+    step = max(factor, VOLUME_RENDER_SLAB_BYTES // plane_bytes // factor * factor)
+    for start in range(z0, z1, step):
+        slab = np.asarray(data[x0:x1, y0:y1, start:min(start + step, z1)])
+        first = (start - z0) // factor
+        grid[:, :, first:first + -(-slab.shape[2] // factor)] = block_reduce(slab, factor, reducer)
+    return grid, box, factor
+
+def padded_render_grid(data, max_voxels=VOLUME_RENDER_VOXELS):
+    """volume_render_grid with a zero border where the crop box is inside the volume, for marching cubes.
+
+    Returns ``(grid, origin, factor)``: grid voxel ``i`` sits at
+    ``origin + i * factor`` in full-resolution voxel coordinates.
+    """
+    grid, box, factor = volume_render_grid(data, max_voxels)
+    # вне рамки данные нулевые: нулевой слой закрывает поверхности на краях рамки
+    pad = [(int(start > 0), int(stop < n)) for (start, stop), n in zip(box, data.shape)]
+    grid = np.pad(grid, pad)
+    origin = [start - low * factor + (factor - 1) / 2 for (start, _), (low, _) in zip(box, pad)]
+    return grid, origin, factor
+
+def create_volume_rendering(data, opacity_function='linear', colormap='viridis',
+                            max_voxels=VOLUME_RENDER_VOXELS, reduction='mean'):
+    """go.Volume of a volume reduced to at most max_voxels (block 'mean' or 'max'), in full-resolution coordinates"""
+    grid, box, factor = volume_render_grid(data, max_voxels, reduction)
+    summary = summarize_volume(data)
+    value_span = max(summary.max - summary.min, 1e-6)
+    grid_norm = (grid - np.float32(summary.min)) / np.float32(value_span)
+
+    # центры блоков в координатах исходного объема
+    axes = [np.float32(start + (factor - 1) / 2) + np.arange(n, dtype=np.float32) * factor
+            for (start, _), n in zip(box, grid.shape)]
+    x, y, z = np.meshgrid(*axes, indexing='ij')
+    center = [float(a[len(a) // 2]) for a in axes]
 
     fig = go.Figure(data=go.Volume(
-        x=np.arange(data.shape[0]),
-        y=np.arange(data.shape[1]),
-        z=np.arange(data.shape[2]),
-        value=data_norm.flatten(),
+        x=x.ravel(),
+        y=y.ravel(),
+        z=z.ravel(),
+        value=grid_norm.ravel(),
         opacity=0.1,
         colorscale=colormap,
-        slices_z=dict(show=True, locations=[data.shape[2]//2]),
-        slices_y=dict(show=True, locations=[data.shape[1]//2]),
-        slices_x=dict(show=True, locations=[data.shape[0]//2]),
+        slices_z=dict(show=True, locations=[center[2]]),
+        slices_y=dict(show=True, locations=[center[1]]),
+        slices_x=dict(show=True, locations=[center[0]]),
         surface_count=20
     ))
     
@@ -61,21 +172,32 @@ def create_volume_rendering(data, opacity_function='linear', colormap='viridis')
             yaxis_title='Y',
             zaxis_title='Z'
         ),
-        title="Volume Rendering"
+        title=f"Volume Rendering ({grid.size:,} voxels, {factor}× {reduction})"
     )
     
     return fig
 
 def segment_regions(data, method='threshold', **kwargs):
 
+    if isinstance(data, ChunkedVolume) and method == 'threshold':
+        threshold = kwargs.get('threshold')
+        if threshold is None:
+            threshold = summarize_volume(data).percentile(90)
+        return data.map_blocks(lambda block: block > threshold, dtype=bool)
+    elif isinstance(data, ChunkedVolume):
+        # watershed needs the whole volume
+        data = data.load()
+
     if method == 'threshold':
-        threshold = kwargs.get('threshold', np.percentile(data, 90))
+        threshold = kwargs.get('threshold')
+        if threshold is None:
+            threshold = summarize_volume(data).percentile(90)
         return data > threshold
     elif method == 'watershed':
         from skimage.segmentation import watershed
         from skimage.feature import peak_local_maxima
         
-        local_maxima = peak_local_maxima(data, min_distance=20, threshold_abs=np.percentile(data, 80))
+        local_maxima = peak_local_maxima(data, min_distance=20, threshold_abs=summarize_volume(data).percentile(80))
         markers = np.zeros_like(data)
         for i, (x, y, z) in enumerate(local_maxima):
             markers[x, y, z] = i + 1
@@ -84,49 +206,200 @@ def segment_regions(data, method='threshold', **kwargs):
     else:
         return data
 
+@memoize
 def compute_statistics(data):
+    summary = summarize_volume(data)
+    moments = volume_stats(data)
     stats = {
-        'basic': {
-            'shape': data.shape,
-            'dtype': data.dtype,
-            'size': data.size,
-            'min': float(data.min()),
-            'max': float(data.max()),
-            'mean': float(data.mean()),
-            'std': float(data.std()),
-            'median': float(np.median(data)),
-            'percentiles': {
-                '25th': float(np.percentile(data, 25)),
-                '75th': float(np.percentile(data, 75)),
-                '90th': float(np.percentile(data, 90)),
-                '95th': float(np.percentile(data, 95)),
-                '99th': float(np.percentile(data, 99))
-            }
-        },
+        'basic': summary_statistics(summary),
         'spatial': {
-            'center_of_mass': ndimage.center_of_mass(data),
-            'moment_of_inertia': ndimage.moment(data, order=2),
-            'volume': np.count_nonzero(data),
-            'surface_area': compute_surface_area(data)
+            'center_of_mass': moments['center_of_mass'],
+            'moment_of_inertia': moments['second_moments'],
+            'volume': moments['nonzero'],
+            'surface_area': compute_surface_area(data, summary.percentile(90))
         }
     }
     
     return stats
 
+def summary_statistics(summary):
+    """The 'basic' section of compute_statistics"""
+    return {
+        'shape': summary.shape,
+        'dtype': summary.dtype,
+        'size': summary.size,
+        'min': summary.min,
+        'max': summary.max,
+        'mean': summary.mean,
+        'std': summary.std,
+        'median': summary.median,
+        'percentiles': {
+            f'{q}th': summary.percentile(q) for q in (25, 75, 90, 95, 99)
+        },
+        'percentile_rank_error': summary.rank_error
+    }
+
+def compute_axis_means(data):
+    """Mean profile along each axis"""
+    return volume_stats(data)['axis_means']
+
+EXACT_HISTOGRAM_SPAN = 1 << 16
+
+def bin_counts(values, edges):
+    """np.histogram counts of values over edges; small-range integers are counted with bincount"""
+    values = np.asarray(values).ravel()
+    if values.dtype.kind in 'biu':
+        low = int(np.floor(edges[0]))
+        span = int(np.ceil(edges[-1])) - low + 1
+        if span <= EXACT_HISTOGRAM_SPAN:
+            per_value = np.bincount(values.astype(np.intp) - low, minlength=span)
+            return np.histogram(np.arange(low, low + span), bins=edges, weights=per_value)[0].astype(np.int64)
+    return np.histogram(values, bins=edges)[0]
+
+@memoize
+def compute_histogram(data, bins=100, axis=None, index=None):
+    """Counts and bin edges of the whole volume, or of slice ``index`` along ``axis``.
+
+    Bins span the volume's value range, so slice histograms are comparable
+    with each other and with the whole-volume one.
+    """
+    summary = summarize_volume(data)
+    low, high = summary.min, summary.max
+    if high <= low:
+        low, high = low - 0.5, high + 0.5
+    edges = np.linspace(low, high, bins + 1)
+
+    if axis is not None:
+        values = data.slice(axis, index) if hasattr(data, 'slice') else np.take(data, index, axis=axis)
+        return bin_counts(values, edges), edges
+
+    if not hasattr(data, 'iter_slabs'):
+        return bin_counts(data, edges), edges
+    counts = np.zeros(bins, dtype=np.int64)
+    for _, slab in data.iter_slabs():
+        counts += bin_counts(slab, edges)
+    return counts, edges
+
+def create_histogram_chart(counts, edges, title):
+    """Bar chart of precomputed histogram counts"""
+    fig = go.Figure(data=go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=np.diff(edges),
+        marker_line_width=0
+    ))
+    fig.update_layout(title=title, xaxis_title='Value', yaxis_title='Count', bargap=0)
+    return fig
+
 def compute_surface_area(data, threshold=None):
+    if isinstance(data, ChunkedVolume):
+        return compute_chunked_surface_area(data, threshold)
+
     if threshold is None:
-        threshold = np.percentile(data, 90)
+        threshold = summarize_volume(data).percentile(90)
     
-    binary_data = data > threshold
+    binary_data = np.asarray(data) > threshold
     verts, faces, _, _ = measure.marching_cubes(binary_data, level=0.5)
 
-    surface_area = 0
-    for face in faces:
-        v1, v2, v3 = verts[face]
-        area = 0.5 * np.linalg.norm(np.cross(v2 - v1, v3 - v1))
-        surface_area += area
-    
-    return surface_area
+    return surface_area(verts, faces)
+
+@memoize
+def surface_mesh(data, isovalue=0.5, step_size=1):
+    """Marching-cubes mesh at a [0, 1] isovalue of the data range, shared by the surface plot and the mesh metrics.
+
+    The isovalue is mapped back to data units instead of normalizing a
+    copy of the volume; ``step_size`` > 1 gives coarse previews whose
+    vertices are still in voxel coordinates. Chunked volumes are never
+    assembled in memory: their mesh comes from a block-mean grid of at most
+    SURFACE_MESH_VOXELS voxels.
+    """
+    summary = summarize_volume(data)
+    level = summary.min + isovalue * ((summary.max - summary.min) or 1.0)
+    if isinstance(data, ChunkedVolume):
+        grid, origin, factor = padded_render_grid(data, SURFACE_MESH_VOXELS)
+        verts, faces, _, _ = measure.marching_cubes(grid, level=level, step_size=step_size)
+        verts = verts * factor + np.asarray(origin)
+        return verts.astype(np.float32), faces.astype(np.int32)
+    volume = np.asarray(data)
+    if not volume.flags.writeable:
+        # marching_cubes не принимает read-only буферы (общие массивы загруженных томов)
+        volume = volume.astype(np.float32)
+    verts, faces, _, _ = measure.marching_cubes(volume, level=level, step_size=step_size)
+    return verts.astype(np.float32), faces.astype(np.int32)
+
+@memoize
+def display_mesh(data, isovalue=0.5, step_size=1, max_faces=MESH_FACE_BUDGET):
+    """surface_mesh decimated to at most max_faces triangles for go.Mesh3d"""
+    verts, faces = surface_mesh(data, isovalue, step_size)
+    return decimate_mesh(verts, faces, max_faces)
+
+def create_mesh_figure(verts, faces, opacity=0.7, title="3D Surface Visualization"):
+    """go.Mesh3d figure of a triangle mesh"""
+    fig = go.Figure(data=[go.Mesh3d(
+        x=verts[:, 0],
+        y=verts[:, 1],
+        z=verts[:, 2],
+        i=faces[:, 0],
+        j=faces[:, 1],
+        k=faces[:, 2],
+        opacity=opacity,
+        colorscale='viridis',
+        name='3D Surface'
+    )])
+
+    fig.update_layout(
+        scene=dict(
+            xaxis_title='X',
+            yaxis_title='Y',
+            zaxis_title='Z',
+            aspectmode='data'
+        ),
+        title=title,
+        showlegend=True
+    )
+
+    return fig
+
+def filter_halo(filter_type, **kwargs):
+    """Voxels of context a filter needs around a block to be exact at block seams"""
+    if filter_type == 'gaussian':
+        return int(np.ceil(4.0 * kwargs.get('sigma', 1.0)))
+    elif filter_type == 'median':
+        return kwargs.get('size', 3) // 2
+    elif filter_type == 'bilateral':
+        return int(np.ceil(3.0 * kwargs.get('sigma_spatial', 1.0)))
+    else:
+        return 0
+
+def normalize_chunked(data, method='minmax'):
+    summary = summarize_volume(data)
+    if method == 'minmax':
+        low, scale = summary.min, summary.max - summary.min
+    elif method == 'zscore':
+        low, scale = summary.mean, summary.std
+    elif method == 'robust':
+        low, scale = summary.median, summary.percentile(75) - summary.percentile(25)
+    else:
+        return data
+
+    return data.map_blocks(lambda block: (as_float(block) - low) / scale)
+
+def compute_chunked_surface_area(data, threshold=None):
+    """Isosurface area summed over blocks that overlap their neighbours by one voxel"""
+    if threshold is None:
+        threshold = summarize_volume(data).percentile(90)
+
+    total_area = 0
+    for index in data.block_indices():
+        region = data.block_region(index)
+        grown = tuple(slice(r.start, min(n, r.stop + 1)) for r, n in zip(region, data.shape))
+        binary_block = data.read_region(grown) > threshold
+        if min(binary_block.shape) < 2 or binary_block.all() or not binary_block.any():
+            continue
+        verts, faces, _, _ = measure.marching_cubes(binary_block, level=0.5)
+        total_area += surface_area(verts, faces)
+
+    return total_area
 
 def create_roi_analysis(data, roi_coords, roi_size=10):
     x, y, z = roi_coords
@@ -138,8 +411,8 @@ def create_roi_analysis(data, roi_coords, roi_size=10):
     ]
     
     roi_stats = {
-        'mean': float(roi_data.mean()),
-        'std': float(roi_data.std()),
+        'mean': float(roi_data.mean(dtype=np.float64)),
+        'std': float(roi_data.std(dtype=np.float64)),
         'min': float(roi_data.min()),
         'max': float(roi_data.max()),
         'volume': roi_data.size,
@@ -148,18 +421,9 @@ def create_roi_analysis(data, roi_coords, roi_size=10):
     
     return roi_stats, roi_data
 
+@memoize
 def create_eeg_analysis(raw, channel_name, time_range=None):
-    channel_idx = raw.ch_names.index(channel_name)
-    
-    if time_range is not None:
-        start_time, end_time = time_range
-        start_idx = raw.time_as_index(start_time)[0]
-        end_idx = raw.time_as_index(end_time)[0]
-        data = raw[channel_idx, start_idx:end_idx][0][0]
-        times = raw.times[start_idx:end_idx]
-    else:
-        data = raw[channel_idx, :][0][0]
-        times = raw.times
+    data, times = raw.window(channel_name, time_range)
     
     stats = {
         'mean': float(np.mean(data)),
@@ -194,6 +458,12 @@ def create_eeg_analysis(raw, channel_name, time_range=None):
     
     return analysis_results
 
+@memoize
+def compute_psd(raw, channel_name, time_range=None, nperseg=1024):
+    """Welch power spectral density of one channel"""
+    data, times = raw.window(channel_name, time_range)
+    return signal.welch(data, fs=raw.info['sfreq'], nperseg=nperseg)
+
 def classify_eeg_rhythms(freqs, psd):
     delta_mask = (freqs >= 0.5) & (freqs <= 4)
     theta_mask = (freqs > 4) & (freqs <= 8)
@@ -241,18 +511,48 @@ def export_visualization(fig, filename, format='html'):
     
     return filename
 
+def slice_image_trace(data, axis, index, window=None, colormap='gray', origin='upper', full_resolution=False):
+    """go.Image of a slice rendered on the server (window/level, colormap, PNG).
+
+    Large volumes are drawn from the pyramid level that fits the viewport;
+    pixels are scaled so the axes stay in full-resolution voxel coordinates.
+    """
+    if window is None:
+        window = default_window(summarize_volume(data))
+    source, source_index, factor = slice_level(data, axis, index, full_resolution)
+    image = SLICE_RENDERER.render(source, axis, source_index, window, colormap, origin=origin)
+    # центр пикселя уровня — центр блока factor×factor исходных вокселей
+    offset = (factor - 1) / 2
+    return go.Image(source=image_source(image), x0=offset, y0=offset, dx=factor, dy=factor)
+
+def create_slice_figure(data, axis, index, window=None, colormap='gray', title=None, full_resolution=False):
+    """Slice as a server-rendered image in a Plotly figure"""
+    fig = go.Figure(data=slice_image_trace(data, axis, index, window, colormap, full_resolution=full_resolution))
+    fig.update_layout(title=title, margin=dict(l=10, r=10, t=40, b=10))
+    fig.update_xaxes(showticklabels=False)
+    fig.update_yaxes(showticklabels=False)
+    return fig
+
+def create_projection_figure(projections, kind):
+    """Проекции вдоль трех осей рядом"""
+    fig = make_subplots(
+        rows=1, cols=3,
+        subplot_titles=('Sagittal (X)', 'Coronal (Y)', 'Axial (Z)')
+    )
+    for axis in range(3):
+        fig.add_trace(go.Heatmap(z=projections[axis][kind], colorscale='gray', showscale=False),
+                      row=1, col=axis + 1)
+    fig.update_layout(height=450, title_text=PROJECTION_LABELS[kind])
+    return fig
+
 def create_comparison_plot(data1, data2, title1="Dataset 1", title2="Dataset 2"):
     fig = make_subplots(
         rows=1, cols=2,
-        subplot_titles=(title1, title2),
-        specs=[[{'type': 'heatmap'}, {'type': 'heatmap'}]]
+        subplot_titles=(title1, title2)
     )
     
-    slice1 = data1[:, :, data1.shape[2]//2]
-    slice2 = data2[:, :, data2.shape[2]//2]
-    
-    fig.add_trace(go.Heatmap(z=slice1, colorscale='gray', showscale=False), row=1, col=1)
-    fig.add_trace(go.Heatmap(z=slice2, colorscale='gray', showscale=False), row=1, col=2)
+    for col, data in enumerate((data1, data2), start=1):
+        fig.add_trace(slice_image_trace(data, 2, data.shape[2]//2, origin='lower'), row=1, col=col)
     
     fig.update_layout(height=600, title_text="Data Comparison")
     
@@ -0,0 +1,318 @@
+"""
+Lazy NIfTI volume access for the Advanced Medical Visualization Tool
+"""
+
+import copy
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+import weakref
+
+import numpy as np
+import nibabel as nib
+
+from chunked_store import OUT_OF_CORE_BYTES, ChunkedVolume, chunk_store_path
+
+SLAB_BYTES = 64 * 1024 * 1024
+SIDECAR_CACHE_DIR = './temp_nifti_cache'
+SIDECAR_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+INFLATE_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+_LIVE_VOLUMES = weakref.WeakSet()
+
+
+def live_sidecar_paths():
+    """Sidecar copies some LazyVolume in this process still reads from"""
+    return [volume.source_path for volume in list(_LIVE_VOLUMES) if volume.source_path != volume.file_path]
+
+
+def volume_dtype(image):
+    """Dtype a volume is held in: its on-disk dtype, or float32 when scl_slope/scl_inter rescale it"""
+    on_disk = np.dtype(image.get_data_dtype())
+    # nibabel moves scl_slope/scl_inter from the header onto the array proxy at load time
+    slope = getattr(image.dataobj, 'slope', 1.0)
+    inter = getattr(image.dataobj, 'inter', 0.0)
+    if slope == 1.0 and inter == 0.0:
+        return on_disk
+    return np.dtype(np.float64) if on_disk == np.float64 else np.dtype(np.float32)
+
+
+class SidecarCache:
+    """Decompressed copies of .nii.gz volumes, evicted least recently used first.
+
+    The first open of a compressed volume inflates it once into the cache
+    directory; later opens memory-map the plain .nii copy. Entries are keyed
+    by source path, size and mtime, and their mtime doubles as the LRU
+    clock so the policy survives restarts. Copies that open volumes still
+    read from are never evicted: nibabel reopens the file on every read.
+    """
+
+    def __init__(self, root=SIDECAR_CACHE_DIR, max_bytes=SIDECAR_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflating = {}
+
+    def entry_path(self, source_path):
+        st = os.stat(source_path)
+        ident = f'{os.path.abspath(source_path)}:{st.st_size}:{st.st_mtime_ns}'
+        digest = hashlib.sha1(ident.encode()).hexdigest()
+        return os.path.join(self.root, f'{digest}.nii')
+
+    def get(self, source_path):
+        """Path of the decompressed copy of source_path, inflating it on a miss"""
+        path = self.entry_path(source_path)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+            # the inflate runs under a per-entry lock: other files are not held up
+            entry_lock = self._inflating.setdefault(path, threading.Lock())
+
+        with entry_lock:
+            try:
+                if not os.path.exists(path):
+                    os.makedirs(self.root, exist_ok=True)
+                    tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+                    try:
+                        with gzip.open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                            shutil.copyfileobj(src, dst, INFLATE_CHUNK_BYTES)
+                        os.replace(tmp_path, path)
+                    finally:
+                        if os.path.exists(tmp_path):
+                            os.unlink(tmp_path)
+            finally:
+                with self._lock:
+                    self._inflating.pop(path, None)
+
+        with self._lock:
+            self.evict(keep=live_sidecar_paths() + [path])
+        return path
+
+    def entries(self):
+        """Completed copies in the cache (in-flight .tmp files are left alone)"""
+        if not os.path.isdir(self.root):
+            return []
+        return [entry for entry in os.scandir(self.root) if entry.is_file() and entry.name.endswith('.nii')]
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in self.entries())
+
+    def evict(self, keep=()):
+        """Remove least recently used copies, other than the paths in keep, until the cache fits in max_bytes"""
+        keep = {os.path.abspath(path) for path in keep}
+        entries = [entry for entry in self.entries() if os.path.abspath(entry.path) not in keep]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        total = self.size()
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                # still memory-mapped by a session on platforms that lock open files
+                continue
+            total -= size
+
+
+SIDECAR_CACHE = SidecarCache()
+
+
+class SharedArrays:
+    """Read-only volume arrays published once per process and referenced by every session.
+
+    Arrays are keyed by the volume's ``content_key`` and held weakly: an
+    array lives as long as some handle still references it, so memory grows
+    with the number of datasets open rather than the number of sessions.
+    Published arrays are marked read-only; code that modifies voxels must
+    work on its own copy.
+    """
+
+    def __init__(self):
+        self._arrays = weakref.WeakValueDictionary()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Shared array for key, built with build() by the first caller"""
+        with self._lock:
+            array = self._arrays.get(key)
+            if array is not None:
+                return array
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                array = self._arrays.get(key)
+            if array is None:
+                try:
+                    array = build()
+                    array.flags.writeable = False
+                    with self._lock:
+                        self._arrays[key] = array
+                finally:
+                    with self._lock:
+                        self._building.pop(key, None)
+            return array
+
+    def __len__(self):
+        return len(self._arrays)
+
+
+SHARED_ARRAYS = SharedArrays()
+
+
+class LazyVolume:
+    """Handle on a NIfTI volume that reads voxels on demand.
+
+    Indexing goes through nibabel's ``dataobj`` array proxy (memory-mapped
+    for uncompressed .nii files), so slices, slabs and ROIs only read the
+    bytes they cover. :meth:`load` promotes the volume to a full in-memory
+    array, which is kept until :meth:`release` is called. Loaded arrays
+    come from :data:`SHARED_ARRAYS`, so handles on the same file share one
+    read-only buffer.
+
+    Voxels are returned in :func:`volume_dtype` rather than float64, so
+    kernels that need floating point upcast locally. Compressed volumes are
+    read through their :class:`SidecarCache` copy when a cache is given.
+    """
+
+    def __init__(self, file_path, mmap=True, sidecar_cache=SIDECAR_CACHE):
+        self.file_path = file_path
+        self.source_path = file_path
+        st = os.stat(file_path)
+        self.content_key = f'nifti:{os.path.abspath(file_path)}:{st.st_size}:{st.st_mtime_ns}'
+        if sidecar_cache is not None and file_path.lower().endswith('.gz'):
+            self.source_path = sidecar_cache.get(file_path)
+        self.image = nib.load(self.source_path, mmap=mmap)
+        self.header = self.image.header
+        self.affine = self.image.affine
+        self._dtype = volume_dtype(self.image)
+        self._array = None
+        _LIVE_VOLUMES.add(self)
+
+    @property
+    def dataobj(self):
+        return self.image.dataobj
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def is_loaded(self):
+        return self._array is not None
+
+    @property
+    def resident_bytes(self):
+        # memory-mapped arrays live in the page cache, not in the process
+        if self._array is None or isinstance(self._array.base, np.memmap):
+            return 0
+        return self.nbytes
+
+    @property
+    def resident_key(self):
+        # the shared array is its own base, as the memory governor expects of plain arrays
+        return id(self._array)
+
+    def __getitem__(self, key):
+        if self._array is not None:
+            return self._array[key]
+        return np.asarray(self.image.dataobj[key]).astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.load()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded else "lazy"
+        return f"LazyVolume({self.file_path!r}, shape={self.shape}, {state})"
+
+    def slice(self, axis, index):
+        """Read a single plane perpendicular to ``axis``"""
+        key = [slice(None)] * self.ndim
+        key[axis] = index
+        return self[tuple(key)]
+
+    def slab(self, axis, start, stop):
+        """Read planes ``start:stop`` along ``axis``"""
+        key = [slice(None)] * self.ndim
+        key[axis] = slice(start, stop)
+        return self[tuple(key)]
+
+    def roi(self, center, half_size):
+        """Read the box of ``half_size`` voxels around ``center``, clipped to the volume"""
+        key = tuple(
+            slice(max(0, c - half_size), min(n, c + half_size))
+            for c, n in zip(center, self.shape)
+        )
+        return self[key]
+
+    def iter_slabs(self, axis=-1, max_bytes=SLAB_BYTES):
+        """Yield ``(start, slab)`` pairs covering the volume along ``axis``"""
+        axis = axis % self.ndim
+        plane_bytes = max(1, self.nbytes // max(1, self.shape[axis]))
+        step = max(1, max_bytes // plane_bytes)
+        for start in range(0, self.shape[axis], step):
+            yield start, self.slab(axis, start, min(start + step, self.shape[axis]))
+
+    def load(self, progress=None):
+        """Promote to a full in-memory array (cached on the handle).
+
+        With a ``progress`` callback the volume is read slab by slab and the
+        callback receives the fraction read so far.
+        """
+        if self._array is None:
+            self._array = SHARED_ARRAYS.get(self.content_key, lambda: self._read(progress))
+        return self._array
+
+    def _read(self, progress=None):
+        if progress is None:
+            return np.asarray(self.image.dataobj, dtype=self.dtype)
+        array = np.empty(self.shape, dtype=self.dtype)
+        for start, slab in self.iter_slabs():
+            array[..., start:start + slab.shape[-1]] = slab
+            progress((start + slab.shape[-1]) / self.shape[-1])
+        return array
+
+    def handle(self):
+        """Another handle on the same file and shared array, released independently"""
+        handle = copy.copy(self)
+        _LIVE_VOLUMES.add(handle)
+        return handle
+
+    def release(self):
+        """Drop this handle's reference to the shared array, falling back to on-demand reads"""
+        self._array = None
+
+
+def open_volume(file_path):
+    """Open a NIfTI file as a LazyVolume, or as a ChunkedVolume when it is too large for memory.
+
+    Returns ``(volume, header, affine)``.
+    """
+    volume = LazyVolume(file_path)
+    header, affine = volume.header, volume.affine
+    if volume.ndim == 3 and volume.nbytes > OUT_OF_CORE_BYTES:
+        volume = ChunkedVolume.from_volume(volume, chunk_store_path(file_path))
+    return volume, header, affine
@@ -0,0 +1,99 @@
+"""
+Whole-volume summary statistics computed once per volume
+"""
+
+import numpy as np
+
+from chunked_store import ChunkedVolume, block_sketch
+from memo import memoize
+from stats_engine import volume_stats
+
+SUMMARY_PERCENTILES = (1, 5, 25, 50, 75, 80, 90, 95, 99)
+
+
+def partition_percentiles(values, percentiles):
+    """np.percentile (linear interpolation) of a flat array for several percentiles in one partition.
+
+    ``values`` is reordered in place; pass a copy if the order matters.
+    """
+    n = values.size
+    ranks = np.asarray(percentiles, dtype=np.float64) / 100 * (n - 1)
+    lo = np.floor(ranks).astype(np.intp)
+    hi = np.ceil(ranks).astype(np.intp)
+    kth = np.unique(np.concatenate([lo, hi, [0, n - 1]]))
+    values.partition(kth)
+    low_values = values[lo].astype(np.float64)
+    high_values = values[hi].astype(np.float64)
+    return low_values + (high_values - low_values) * (ranks - lo)
+
+
+class VolumeSummary:
+    """Min, max, mean, std, nonzero count and a set of percentiles of one volume.
+
+    Built once per volume (see :func:`summarize_volume`); pages take their
+    thresholds and slider defaults from it instead of calling np.percentile
+    on every rerun. Percentiles of in-memory volumes are exact
+    (``rank_error`` 0); those of chunked volumes come from a quantile sketch
+    and are within ``rank_error`` (as a fraction of voxels) of the true rank.
+    """
+
+    def __init__(self, shape, dtype, v_min, v_max, mean, std, nonzero, percentiles, rank_error=0.0):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.min = float(v_min)
+        self.max = float(v_max)
+        self.mean = float(mean)
+        self.std = float(std)
+        self.nonzero = int(nonzero)
+        self.percentiles = {float(q): float(v) for q, v in percentiles.items()}
+        self.rank_error = float(rank_error)
+
+    @classmethod
+    def from_array(cls, data, percentiles=SUMMARY_PERCENTILES):
+        """Summary of an array or LazyVolume: moments from volume_stats, percentiles from one partitioned read"""
+        moments = volume_stats(data)
+        values = np.asarray(data[...])
+        if isinstance(data, np.ndarray) or not values.flags.writeable:
+            # partition reorders in place: copy caller arrays and shared read-only buffers only
+            values = values.copy()
+        # memory order: NIfTI arrays are Fortran-ordered and a C-order ravel would copy them
+        values = values.ravel(order='K')
+        return cls(
+            data.shape, data.dtype, moments['min'], moments['max'], moments['mean'], moments['std'],
+            moments['nonzero'], dict(zip(percentiles, partition_percentiles(values, percentiles))),
+        )
+
+    @classmethod
+    def from_chunked(cls, volume, percentiles=SUMMARY_PERCENTILES):
+        """Summary of a ChunkedVolume from volume_stats and a block-wise quantile sketch"""
+        moments = volume_stats(volume)
+        sketch = block_sketch(volume)
+        return cls(
+            volume.shape, volume.dtype, moments['min'], moments['max'], moments['mean'], moments['std'],
+            moments['nonzero'], dict(zip(percentiles, sketch.percentiles(percentiles))), sketch.rank_error(),
+        )
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def median(self):
+        return self.percentile(50)
+
+    def percentile(self, q):
+        try:
+            return self.percentiles[float(q)]
+        except KeyError:
+            raise KeyError(f"Percentile {q} is not in the summary; computed: {sorted(self.percentiles)}") from None
+
+    def __repr__(self):
+        return f"VolumeSummary(shape={self.shape}, min={self.min:g}, max={self.max:g}, median={self.median:g})"
+
+
+@memoize
+def summarize_volume(data):
+    """VolumeSummary of an array, LazyVolume or ChunkedVolume, cached by dataset"""
+    if isinstance(data, ChunkedVolume):
+        return VolumeSummary.from_chunked(data)
+    return VolumeSummary.from_array(data)